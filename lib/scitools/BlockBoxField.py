@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Block-decomposed scalar (or vector) field over a BoxGrid or
+UniformBoxGrid, for stencil computations in several processes.
+
+The grid points are divided into blocks (sub-boxes), e.g. 2x2 blocks
+in 2D. Each block owns a part of the grid points and has a number of
+ghost layers with copies of the values owned by the neighboring
+blocks. The values of each block are stored in shared memory
+(multiprocessing.shared_memory), so that the blocks can be updated
+by functions running in a process pool, without copying the field
+between the processes. Between the updates, exchange_halos copies
+the owned values into the ghost layers of the neighbors.
+
+Example (explicit diffusion steps in 2D)::
+
+    def diffusion_step(u, g, dt):
+        # u: block values with ghost layers, g: grid of the block
+        u_new = u.copy()
+        for i, j in g.iter('interior', vectorized_version=False):
+            u_new[i,j] = u[i,j] + dt*(u[i+1,j] + u[i-1,j] + u[i,j+1]
+                                      + u[i,j-1] - 4*u[i,j])
+        return u_new
+
+    g = UniformBoxGrid(min=(0,0), max=(1,1), division=(400,400))
+    u = BlockBoxField(g, 'u', blocks=(2,2), ghost=1)
+    u.scatter(initial_values)
+    with concurrent.futures.ProcessPoolExecutor(4) as pool:
+        for n in range(nsteps):
+            u.exchange_halos()
+            u.apply(diffusion_step, args=(0.2,), pool=pool)
+    field = u.gather()   # BoxField over g
+    u.unlink()
+
+(a vectorized version of the loop applies the slices from
+g.iter('interior') to u). Functions given to apply must
+be defined at the top level of a module (so that they can be sent to
+other processes).
+"""
+
+from scitools.BoxField import BoxField
+from scitools.BoxGrid import UniformBoxGrid, BoxGrid
+from multiprocessing import shared_memory
+import numpy as np
+
+__all__ = ['BlockBoxField']
+
+
+class _Block(object):
+    """
+    Data about one block: index (position among the blocks), owned
+    and local (owned plus ghost layers) slices in the global grid,
+    owned slices in the local array, shape of the local array, grid
+    over the local points, and the shared memory with the values.
+    """
+    def __init__(self, index, owned, local, grid, shm, shape):
+        self.index = index
+        self.owned = owned
+        self.local = local
+        self.interior = tuple([slice(o.start - l.start, o.stop - l.start)
+                               for o, l in zip(owned, local)])
+        self.grid = grid
+        self.shm = shm
+        self.shape = shape
+
+
+class BlockBoxField(object):
+    """
+    Field over a BoxGrid or UniformBoxGrid grid, stored as blocks
+    with ghost layers in shared memory.
+
+    =============      =============================================
+      Attributes                       Description
+    =============      =============================================
+    grid               reference to the underlying (global) grid
+    name               name of the field
+    blocks             list of block data (see block_values)
+    nblocks            no of blocks in each space direction
+    ghost              no of ghost layers
+    =============      =============================================
+
+    >>> g = UniformBoxGrid(min=(0,0), max=(1,1), division=(4,3))
+    >>> values = g.vectorized_eval(lambda x, y: 4*x + 3*y)
+    >>> u = BlockBoxField(g, 'u', blocks=(2,2), ghost=1, values=values)
+    >>> [u.block_values(b).shape for b in range(len(u.blocks))]
+    [(3, 3), (3, 3), (4, 3), (4, 3)]
+    >>> np.allclose(u.gather().values, values)
+    True
+    >>> u.apply(lambda v, grid: v + 1)    # only the owned points change
+    >>> np.allclose(u.block_values(0), values[u.blocks[0].local] + 1)
+    False
+    >>> u.exchange_halos()
+    >>> all([np.allclose(u.block_values(b), values[block.local] + 1)
+    ...      for b, block in enumerate(u.blocks)])
+    True
+    >>> u.unlink()
+    """
+
+    def __init__(self, grid, name, blocks=2, ghost=1, vector=0,
+                 dtype=float, values=None):
+        """
+        =============      ===============================================
+          Arguments                          Description
+        =============      ===============================================
+        *grid*             grid instance
+        *name*             name of the field
+        *blocks*           no of blocks in each space direction (int or
+                           list)
+        *ghost*            no of ghost layers around the blocks
+        *vector*           scalar field if 0, otherwise the no of vector
+                           components (first index in the values)
+        *dtype*            type of the values
+        *values*           optional array (or BoxField) with the values
+                           over the global grid
+        =============      ===============================================
+        """
+        self.grid = grid
+        self.name = name
+        if isinstance(blocks, int):
+            blocks = [blocks] * grid.nsd
+        if len(blocks) != grid.nsd:
+            raise ValueError('blocks=%s must have %d entries' %
+                             (blocks, grid.nsd))
+        for n, b in zip(grid.shape, blocks):
+            if not 1 <= b <= n:
+                raise ValueError('cannot divide %d grid points into %d '
+                                 'blocks' % (n, b))
+        self.nblocks = tuple(blocks)
+        self.ghost = ghost
+        self.vector = vector
+        self.dtype = np.dtype(dtype)
+
+        # owned index ranges in each direction:
+        bounds = []
+        for n, b in zip(grid.shape, blocks):
+            points = np.linspace(0, n, b + 1).astype(int)
+            bounds.append(list(zip(points[:-1], points[1:])))
+
+        self.blocks = []
+        try:
+            for index in np.ndindex(*self.nblocks):
+                owned = []
+                local = []
+                for i, k in enumerate(index):
+                    start, stop = bounds[i][k]
+                    owned.append(slice(start, stop))
+                    local.append(slice(max(start - ghost, 0),
+                                       min(stop + ghost, grid.shape[i])))
+                shape = tuple([s.stop - s.start for s in local])
+                if vector > 0:
+                    shape = (vector,) + shape
+                size = int(np.prod(shape)) * self.dtype.itemsize
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(size, 1))
+                self.blocks.append(_Block(index, tuple(owned), tuple(local),
+                                          self._local_grid(local), shm,
+                                          shape))
+                self.block_values(-1)[...] = 0
+        except:
+            self.unlink()
+            raise
+
+        if values is not None:
+            self.scatter(values)
+
+    def _local_grid(self, local):
+        """Return a grid over the points in the slices local."""
+        coor = [c[s] for c, s in zip(self.grid.coor, local)]
+        if isinstance(self.grid, BoxGrid) or \
+           not isinstance(self.grid, UniformBoxGrid) or \
+           min([len(c) for c in coor]) < 2:
+            return BoxGrid(coor, dirnames=self.grid.dirnames)
+        return UniformBoxGrid(min=[c[0] for c in coor],
+                              max=[c[-1] for c in coor],
+                              division=[len(c) - 1 for c in coor],
+                              dirnames=self.grid.dirnames)
+
+    def block_values(self, b):
+        """
+        Return the array with the values of block no b (including
+        the ghost layers), an array over the shared memory.
+        self.blocks[b].interior holds the slices of the owned points
+        in this array and self.blocks[b].grid is the grid over the
+        points of the array.
+        """
+        block = self.blocks[b]
+        return np.ndarray(block.shape, self.dtype, buffer=block.shm.buf)
+
+    def _values_slices(self, slices):
+        """Return index for slices in values (with a component axis)."""
+        return (Ellipsis,) + tuple(slices)
+
+    def scatter(self, values):
+        """
+        Copy values over the global grid (array or BoxField) to the
+        blocks (the owned points and the ghost layers).
+        """
+        if isinstance(values, BoxField):
+            values = values.values
+        for b, block in enumerate(self.blocks):
+            self.block_values(b)[...] = \
+                values[self._values_slices(block.local)]
+
+    def gather(self, out=None):
+        """
+        Return a BoxField over the global grid with the values owned
+        by the blocks. If out is a BoxField (or an array), the values
+        are copied into it.
+        """
+        if out is None:
+            out = BoxField(self.grid, self.name, vector=self.vector)
+        values = out.values if isinstance(out, BoxField) else out
+        for b, block in enumerate(self.blocks):
+            values[self._values_slices(block.owned)] = \
+                self.block_values(b)[self._values_slices(block.interior)]
+        return out
+
+    def exchange_halos(self):
+        """
+        Copy the values owned by each block into the ghost layers
+        of the neighboring blocks (also diagonal neighbors).
+        """
+        if self.ghost == 0:
+            return
+        for b, block in enumerate(self.blocks):
+            target = None
+            for n, neighbor in enumerate(self.blocks):
+                if n == b or max([abs(i - j) for i, j in
+                                  zip(block.index, neighbor.index)]) > 1:
+                    continue
+                # overlap between the neighbor's owned points and the
+                # ghost points of block (indices in the local arrays):
+                to_slices = []
+                from_slices = []
+                for l, nl, no in zip(block.local, neighbor.local,
+                                     neighbor.owned):
+                    start = max(l.start, no.start)
+                    stop = min(l.stop, no.stop)
+                    if start >= stop:
+                        break
+                    to_slices.append(slice(start - l.start, stop - l.start))
+                    from_slices.append(slice(start - nl.start,
+                                             stop - nl.start))
+                else:
+                    if target is None:
+                        target = self.block_values(b)
+                    target[self._values_slices(to_slices)] = \
+                        self.block_values(n)[self._values_slices(from_slices)]
+
+    def apply(self, func, args=(), pool=None):
+        """
+        Call func(values, grid, *args) for each block, where values is
+        the block's array (with ghost layers) and grid is the grid
+        over the points in the array. func can update values in place
+        and return None, or return an array with the new values (of
+        the same shape as values); only the values at the owned
+        points of the block are stored.
+        If pool is a concurrent.futures executor (or multiprocessing
+        pool) with processes, the blocks are updated in parallel;
+        func must then be a function defined at the top level of
+        a module. Call exchange_halos before apply to update the
+        ghost layers.
+        """
+        if pool is None:
+            for b, block in enumerate(self.blocks):
+                _store(self.block_values(b), block.interior,
+                       func(self.block_values(b), block.grid, *args))
+        else:
+            tasks = [(func, block.shm.name, block.shape, self.dtype.str,
+                      block.interior, block.grid, args)
+                     for block in self.blocks]
+            for r in pool.map(_apply_block, tasks):
+                pass  # (iterate to get any exceptions from the workers)
+
+    def close(self):
+        """Close the access to the shared memory."""
+        for block in self.blocks:
+            block.shm.close()
+
+    def unlink(self):
+        """Close and free the shared memory."""
+        for block in self.blocks:
+            block.shm.close()
+            block.shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+    def __str__(self):
+        s = 'Vector field' if self.vector else 'Scalar field'
+        return '%s in %s blocks with %d ghost layers, over %s' % \
+            (s, 'x'.join([str(b) for b in self.nblocks]), self.ghost,
+             self.grid)
+
+
+def _store(values, interior, result):
+    """Store the owned part of result (if not None) in values."""
+    if result is not None:
+        interior = (Ellipsis,) + tuple(interior)
+        values[interior] = np.asarray(result)[interior]
+
+
+def _attach(name):
+    """
+    Attach to an existing shared memory block. (Processes started by
+    multiprocessing share the resource tracker of the main process,
+    where the block is already registered, so the block is not
+    removed when a worker exits.)
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 (no track argument)
+        return shared_memory.SharedMemory(name=name)
+
+
+def _apply_block(task):
+    """Worker function for BlockBoxField.apply in a process pool."""
+    func, name, shape, dtype, interior, grid, args = task
+    shm = _attach(name)
+    try:
+        values = np.ndarray(shape, dtype, buffer=shm.buf)
+        _store(values, interior, func(values, grid, *args))
+        del values
+    finally:
+        shm.close()
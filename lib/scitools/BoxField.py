@@ -6,6 +6,7 @@ from __future__ import print_function
 
 from scitools.BoxGrid import BoxGrid, UniformBoxGrid, X, Y, Z
 import numpy as np
+import collections
 
 import dolfin
 
@@ -85,6 +86,8 @@ class BoxField(Field):
 
         ``u.grid.coorv`` is a list of coordinate arrays that are
         suitable for Matlab-style visualization of 2D scalar fields.
+        (The arrays are sparse, construct the grid with
+        ``dense_coorv=True`` if full coordinate arrays are needed.)
         Also note how one can access the coordinates and u value at
         a point (i,j) in the grid.
         """
@@ -145,6 +148,15 @@ class BoxField(Field):
         s += ', over ' + str(self.grid)
         return s
 
+    def interpolate(self, points):
+        """
+        Interpolate the field at n points, given as an array of shape
+        (n, nsd). Return an array of shape (n,) for a scalar field and
+        (ncomponents, n) for a vector field.
+        (See the interpolate method in the grid class.)
+        """
+        return self.grid.interpolate(points, self.values)
+
     def gridline(self, start_coor, direction=0, end_coor=None,
                  snap=True):
         """
@@ -158,7 +170,12 @@ class BoxField(Field):
         fixed_coor differs from coordinates in start_coor.
 
         If snap is True, the line is snapped onto the grid, otherwise
-        values along the line must be interpolated (not yet implemented).
+        the values along the line (at the grid coordinates in the
+        given direction) are interpolated from the surrounding grid
+        lines. The returned values are a view of self.values if the
+        line coincides with a grid line, otherwise a new array.
+        For a vector field, the first index in the returned values
+        is the component.
 
         >>> g2 = UniformBoxGrid.init_fromstring('[-1,1]x[-1,2] [0:3]x[0:4]')
         >>> print g2
@@ -177,20 +194,36 @@ class BoxField(Field):
         [-0.5         0.16666667  0.83333333  1.5       ]
         >>> print fixed_coor, snapped
         [0.5] False
+        >>> xc, uc, fixed_coor, snapped = u.gridline((-1,0.4), 0, snap=False)
+        >>> print(uc)
+        [-0.6         0.06666667  0.73333333  1.4       ]
         >>> #plot(xc, uc, title='u(x, y=%g)' % fixed_coor)
         """
-        if not snap:
-            raise NotImplementedError('Use snap=True, no interpolation impl.')
-
         slice_index, snapped = \
             self.grid.gridline_slice(start_coor, direction, end_coor)
-        fixed_coor = [self.grid[s][i] for s, i in enumerate(slice_index)
-                      if not isinstance(i, slice)]
+        xc = self.grid.coor[direction][slice_index[direction].start:
+                                       slice_index[direction].stop]
+        if not snap:
+            # no interpolation if the line is on a grid line:
+            match = self.grid.locate_cell(start_coor)[2]
+            snap = np.all([m for i, m in enumerate(match) if i != direction])
+        if snap:
+            fixed_coor = [self.grid[s][i] for s, i in enumerate(slice_index)
+                          if not isinstance(i, slice)]
+            values = self.values[(Ellipsis,) + slice_index]
+        else:
+            # interpolate at the points (start_coor with xc in direction)
+            if isinstance(start_coor, (int, float)):
+                start_coor = [start_coor]
+            fixed_coor = [c for i, c in enumerate(start_coor)
+                          if i != direction]
+            points = np.empty((len(xc), self.grid.nsd))
+            points[:] = start_coor
+            points[:, direction] = xc
+            values = self.grid.interpolate(points, self.values)
         if len(fixed_coor) == 1:
             fixed_coor = fixed_coor[0]  # avoid returning list of length 1
-        return self.grid.coor[direction][slice_index[direction].start:
-                                         slice_index[direction].stop], \
-            self.values[slice_index], fixed_coor, snapped
+        return xc, values, fixed_coor, snapped
 
     def gridplane(self, value, constant_coor=0, snap=True):
         """
@@ -200,11 +233,11 @@ class BoxField(Field):
 
         If snap is True, the plane is snapped onto a grid plane such
         that the points in the plane coincide with the grid points.
-        Otherwise, the returned values must be interpolated (not yet impl.).
+        Otherwise, the returned values are interpolated linearly
+        between the two neighboring grid planes.
+        The returned values are a view of self.values if the plane
+        coincides with a grid plane, otherwise a new array.
         """
-        if not snap:
-            raise NotImplementedError('Use snap=True, no interpolation impl.')
-
         slice_index, snapped = self.grid.gridplane_slice(value, constant_coor)
         if constant_coor == 0:
             x = self.grid.coor[1]
@@ -215,8 +248,42 @@ class BoxField(Field):
         elif constant_coor == 2:
             x = self.grid.coor[0]
             y = self.grid.coor[1]
-        fixed_coor = self.grid.coor[constant_coor][slice_index[constant_coor]]
-        return x, y, self.values[slice_index], fixed_coor, snapped
+        if snap or not snapped:
+            fixed_coor = \
+                self.grid.coor[constant_coor][slice_index[constant_coor]]
+            values = self.values[(Ellipsis,) + slice_index]
+        else:
+            fixed_coor = value
+            cell, distance, width = \
+                self.grid._locate_axis(constant_coor, np.array([value]))
+            cell = cell[0]
+            w = distance[0] / np.asarray(width).flat[0]
+            axis = self.values.ndim - self.grid.nsd + constant_coor
+            values = (1 - w) * np.take(self.values, cell, axis=axis) + \
+                w * np.take(self.values, cell + 1, axis=axis)
+        return x, y, values, fixed_coor, snapped
+
+    def line(self, start_coor, end_coor, npoints=101):
+        """
+        Return points and interpolated field values along an
+        arbitrary (oblique) straight line from start_coor to end_coor,
+        sampled at npoints equally spaced points.
+        The points are returned as an array of shape (npoints, nsd)
+        and the values as an array of shape (npoints,), or
+        (ncomponents, npoints) for a vector field.
+
+        >>> g2 = UniformBoxGrid.init_fromstring('[-1,1]x[-1,2] [0:3]x[0:4]')
+        >>> u = BoxField(g2, 'u')
+        >>> u.values = u.grid.vectorized_eval(lambda x,y: x + y)
+        >>> points, uc = u.line((-1,-1), (1,2), npoints=3)
+        >>> print(uc)
+        [-2.   0.5  3. ]
+        """
+        start_coor = np.atleast_1d(np.asarray(start_coor, float))
+        end_coor = np.atleast_1d(np.asarray(end_coor, float))
+        t = np.linspace(0, 1, npoints)[:, np.newaxis]
+        points = (1 - t) * start_coor + t * end_coor
+        return points, self.grid.interpolate(points, self.values)
 
 
 def _rank12rankd_mesh(a, shape):
@@ -315,61 +382,119 @@ u2 = interpolate(u, V2)
 
 """ % (str(dolfin_function.ufl_element()), dolfin_function.ufl_element().degree()))
 
-    if dolfin.__version__[:3] == "1.0":
-        nodal_values = dolfin_function.vector().array().copy()
-    else:
-        #map = dolfin_function.function_space().dofmap().vertex_to_dof_map(dolfin_mesh)
-        d2v = dolfin.dof_to_vertex_map(dolfin_function.function_space())
-        nodal_values = dolfin_function.vector().array().copy()
-        nodal_values[d2v] = dolfin_function.vector().array().copy()
-
     if uniform_mesh:
         grid = dolfin_mesh2UniformBoxGrid(dolfin_mesh, division)
     else:
         grid = dolfin_mesh2BoxGrid(dolfin_mesh, division)
 
-    if nodal_values.size > grid.npoints:
-        # vector field, treat each component separately
-        ncomponents = int(nodal_values.size / grid.npoints)
-        try:
-            nodal_values.shape = (ncomponents, grid.npoints)
-        except ValueError as e:
-            raise ValueError('Vector field (nodal_values) has length %d, there are %d grid points, and this does not match with %d components' % (nodal_values.size, grid.npoints, ncomponents))
-        vector_field = [_rank12rankd_mesh(nodal_values[i, :].copy(),
-                                          grid.shape)
-                        for i in range(ncomponents)]
-        nodal_values = np.array(vector_field)
-        bf = BoxField(grid, name=dolfin_function.name(),
-                      vector=ncomponents, values=nodal_values)
-    else:
-        try:
-            nodal_values = _rank12rankd_mesh(nodal_values, grid.shape)
-        except ValueError as e:
-            raise ValueError('DOLFIN function has vector of size %s while the provided mesh has %d points and shape %s' % (nodal_values.size, grid.npoints, grid.shape))
-        bf = BoxField(grid, name=dolfin_function.name(),
-                      vector=0, values=nodal_values)
+    nodal_values = _dolfin_vector_array(dolfin_function.vector())
+    ncomponents = _ncomponents(nodal_values.size, grid)
+    bf = BoxField(grid, name=dolfin_function.name(),
+                  vector=ncomponents if ncomponents > 1 else 0)
+    _gather(nodal_values, bf,
+            _reshape_plan(grid.shape, ncomponents,
+                          dolfin_function.function_space()))
     return bf
 
 
-def update_from_dolfin_array(dolfin_array, box_field):
+def update_from_dolfin_array(dolfin_array, box_field, function_space=None):
     """
     Update the values in a BoxField object box_field with a new
     DOLFIN array (dolfin_array). The array must be reshaped and
     transposed in the right way
     (therefore box_field.copy_values(dolfin_array) will not work).
+
+    If function_space is given, dolfin_array holds the degrees of
+    freedom of a function in this space (e.g. u.vector().array()),
+    otherwise dolfin_array holds the values at the vertices of the
+    mesh (for a vector field: all values of the first component,
+    then all values of the second component, and so on).
+    The values are copied into box_field.values (in place) using a
+    cached index array for the function space and grid.
     """
-    nodal_values = dolfin_array.copy()
-    if len(nodal_values.shape) > 1:
-        raise NotImplementedError  # no support for vector valued functions yet
-        # the problem is in _rank12rankd_mesh
-    try:
-        nodal_values = _rank12rankd_mesh(nodal_values, box_field.grid.shape)
-    except ValueError as e:
-        raise ValueError('DOLFIN function has vector of size %s while the provided mesh demands %s' % (nodal_values.size, box_field.grid.shape))
-    box_field.set_values(nodal_values)
+    if not isinstance(dolfin_array, np.ndarray):
+        dolfin_array = _dolfin_vector_array(dolfin_array)
+    grid = box_field.grid
+    ncomponents = _ncomponents(dolfin_array.size, grid)
+    _gather(dolfin_array.ravel(), box_field,
+            _reshape_plan(grid.shape, ncomponents, function_space))
     return box_field
 
 
+def _dolfin_vector_array(vector):
+    """Return the local values of a DOLFIN vector as an array."""
+    if hasattr(vector, 'get_local'):
+        return vector.get_local()
+    return vector.array()
+
+
+def _ncomponents(size, grid):
+    """Return the no of vector components of size nodal values."""
+    ncomponents = size // grid.npoints
+    if ncomponents < 1 or ncomponents * grid.npoints != size:
+        raise ValueError('DOLFIN function has vector of size %s while the provided mesh has %d points and shape %s' % (size, grid.npoints, grid.shape))
+    return ncomponents
+
+
+# cache of index arrays for _gather, (id(function_space), shape,
+# ncomponents) -> (function_space, index array), with the most
+# recently used plan last. The function space is stored to keep its
+# id valid; at most _reshape_plans_size plans (and function spaces)
+# are kept alive.
+_reshape_plans = collections.OrderedDict()
+_reshape_plans_size = 8
+
+
+def _reshape_plan(shape, ncomponents, function_space=None):
+    """
+    Return the index array that transforms the nodal values of a
+    DOLFIN function (in function_space, over a structured mesh
+    with shape points in each direction) to the values array
+    of a BoxField: values.ravel() = nodal_values[index].
+    If function_space is None, the nodal values are in vertex order
+    (component by component for vector fields).
+    """
+    if function_space is not None and dolfin.__version__[:3] == "1.0":
+        function_space = None  # dofs are in vertex order
+    key = (id(function_space), tuple(shape), ncomponents)
+    if key in _reshape_plans:
+        _reshape_plans.move_to_end(key)
+    else:
+        # Standard DOLFIN numbering numbers the vertices along the
+        # x[0] axis, then x[1] axis, and so on:
+        npoints = int(np.prod(shape))
+        vertex = np.arange(npoints).reshape(shape[::-1]).transpose().ravel()
+        components = np.arange(ncomponents)[:, np.newaxis]
+        if function_space is None:
+            index = components * npoints + vertex
+        else:
+            # vertex_to_dof_map numbers vector components as
+            # vertex*ncomponents + component
+            v2d = np.asarray(dolfin.vertex_to_dof_map(function_space))
+            index = v2d[vertex * ncomponents + components]
+        index = index.ravel()
+        index.flags.writeable = False
+        _reshape_plans[key] = (function_space, index)
+        if len(_reshape_plans) > _reshape_plans_size:
+            _reshape_plans.popitem(last=False)  # least recently used
+    return _reshape_plans[key][1]
+
+
+def _gather(nodal_values, box_field, index):
+    """Set box_field.values.ravel() = nodal_values[index], in place."""
+    values = box_field.values
+    if index.size != int(np.prod(box_field.required_shape)):
+        raise ValueError('reshape plan with %d indices for a field of '
+                         'shape %s' % (index.size,
+                                       tuple(box_field.required_shape)))
+    if values.shape == tuple(box_field.required_shape) and \
+       values.dtype == nodal_values.dtype and values.flags.c_contiguous:
+        np.take(nodal_values, index, out=values.reshape(-1))
+    else:
+        box_field.set_values(np.take(nodal_values, index).reshape(
+            box_field.required_shape))
+
+
 def _test(g):
     print('grid: %s' % g)
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Time series of scalar (or vector) fields over one BoxGrid or
+UniformBoxGrid, stored on disk.
+
+The values of all time steps (frames) are stored after each other in
+one binary file, which is memory-mapped for reading, so slicing by
+time index and space only reads the data that are used. The minimum,
+maximum and norm of the values are computed when a frame is written
+and kept in a small text file, so they are available without reading
+the frames again (e.g. for plotting the norm as a function of time or
+checking convergence).
+
+Files: name.hdr (grid and frame data), name.dat (the frames), and
+name.steps (time, min, max and norm of each frame, one line each).
+
+Example::
+
+    g = UniformBoxGrid(min=(0,0), max=(1,1), division=(100,100))
+    series = BoxFieldSeries('u_history', g, 'u')
+    for n in range(nsteps):
+        ...  # compute u (BoxField or array over g) at time t
+        series.append(u, t)
+    series.close()
+
+    series = BoxFieldSeries('u_history')    # read
+    u = series[-1]                 # BoxField at the last time step
+    u_mid = series[:, 50, :]       # all time steps at x index 50
+    plot(series.times, series.norm)
+"""
+
+from scitools.BoxField import BoxField
+from scitools.BoxGrid import UniformBoxGrid, BoxGrid
+import numpy as np
+import ast
+import os
+
+__all__ = ['BoxFieldSeries']
+
+
+class BoxFieldSeries(object):
+    """
+    Time series of fields over a grid, stored in files.
+
+    =============      =============================================
+      Attributes                       Description
+    =============      =============================================
+    grid               the grid of all fields
+    name               name of the field
+    times              array of the time values of the frames
+    min, max, norm     arrays with the min/max value and the
+                       (Euclidean) norm of each frame
+    values             (memory-mapped, read-only) array of all frames,
+                       the first index is the frame number
+    =============      =============================================
+
+    >>> import tempfile, os
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'u')
+    >>> g = UniformBoxGrid(min=(0,0), max=(1,1), division=(2,1))
+    >>> with BoxFieldSeries(filename, g, 'u') as series:
+    ...     for n in range(3):
+    ...         series.append(n*np.ones(g.shape), t=0.1*n)
+    >>> series = BoxFieldSeries(filename)
+    >>> len(series), series.values.shape, series.times.tolist()
+    (3, (3, 3, 2), [0.0, 0.1, 0.2])
+    >>> series.max.tolist(), float(series[2].values[1, 0])
+    ([0.0, 1.0, 2.0], 2.0)
+    >>> series[:, 0, 1].tolist()    # all frames at one grid point
+    [0.0, 1.0, 2.0]
+
+    An interrupted append (here half a frame and part of its line
+    in the steps file) is removed when the series is opened for
+    appending again:
+
+    >>> f = open(filename + '.dat', 'ab')
+    >>> n = f.write(b'\\0'*24); f.close()
+    >>> f = open(filename + '.steps', 'a')
+    >>> n = f.write('0.3 0.0'); f.close()
+    >>> with BoxFieldSeries(filename, mode='a') as series:
+    ...     series.append(np.full(g.shape, 5.0), t=0.3)
+    >>> series = BoxFieldSeries(filename)
+    >>> len(series), series.time_index(0.29), float(series[-1].values.min())
+    (4, 3, 5.0)
+    """
+
+    def __init__(self, filename, grid=None, name=None, vector=0,
+                 dtype=float, mode=None):
+        """
+        =============      ===============================================
+          Arguments                          Description
+        =============      ===============================================
+        *filename*         stem of the file names
+        *grid*             grid (required for a new series)
+        *name*             name of the field (default filename)
+        *vector*           scalar field if 0, otherwise the no of vector
+                           components (first index in the values)
+        *dtype*            type of the stored values
+        *mode*             'w' (new series), 'a' (append to a series)
+                           or 'r' (read only); default 'w' if grid is
+                           given, otherwise 'r'
+        =============      ===============================================
+        """
+        if mode is None:
+            mode = 'r' if grid is None else 'w'
+        if mode not in ('w', 'a', 'r'):
+            raise ValueError('mode=%r, not w, a or r' % mode)
+        self.filename = filename
+        self.mode = mode
+        hdrfile, self._datfile, self._stepsfile = \
+            [filename + ext for ext in ('.hdr', '.dat', '.steps')]
+
+        if mode == 'w' or (mode == 'a' and not os.path.isfile(hdrfile)):
+            if grid is None:
+                raise ValueError('a grid is required for a new series')
+            self.grid = grid
+            self.name = name if name is not None else filename
+            self.vector = vector
+            self.dtype = np.dtype(dtype)
+            f = open(hdrfile, 'w')
+            f.write(repr({'name': self.name, 'grid': _grid2dict(grid),
+                          'vector': vector, 'dtype': self.dtype.str}))
+            f.close()
+            open(self._datfile, 'wb').close()
+            open(self._stepsfile, 'w').close()
+        else:
+            f = open(hdrfile, 'r')
+            header = ast.literal_eval(f.read())
+            f.close()
+            self.grid = _dict2grid(header['grid'])
+            self.name = header['name']
+            self.vector = header['vector']
+            self.dtype = np.dtype(header['dtype'])
+
+        self.frame_shape = tuple(self.grid.shape)
+        if self.vector > 0:
+            self.frame_shape = (self.vector,) + self.frame_shape
+        self._frame_nbytes = \
+            int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self._steps = self._read_steps()
+        self._values = None  # memory map of the frames
+
+        if mode == 'r':
+            self._fd = self._fs = None
+        else:
+            # remove data of an interrupted append (the complete
+            # lines of the stored frames are kept as they are):
+            os.truncate(self._stepsfile, self._steps_nbytes)
+            os.truncate(self._datfile, len(self._steps)*self._frame_nbytes)
+            self._fs = open(self._stepsfile, 'a')
+            self._fd = open(self._datfile, 'ab')
+
+    def _read_steps(self):
+        """
+        Return list of (t, min, max, norm) of the stored frames.
+        The number of bytes of their lines in the steps file is
+        stored in self._steps_nbytes.
+        """
+        # only complete frames (in case writing was interrupted):
+        nframes = os.path.getsize(self._datfile) // self._frame_nbytes \
+            if self._frame_nbytes > 0 else 0
+        steps = []
+        self._steps_nbytes = 0
+        f = open(self._stepsfile, 'rb')
+        for line in f:
+            if not line.endswith(b'\n') or len(steps) == nframes:
+                break
+            steps.append(tuple([float(w) for w in line.split()]))
+            self._steps_nbytes += len(line)
+        f.close()
+        return steps
+
+    def append(self, values, t=None):
+        """
+        Add a frame (BoxField or array over the grid) at time t
+        (default: the frame number).
+        """
+        if self._fd is None:
+            raise IOError('series %s is opened for reading' % self.filename)
+        if isinstance(values, BoxField):
+            values = values.values
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        if values.shape != self.frame_shape:
+            raise ValueError('frame of shape %s, series has shape %s' %
+                             (values.shape, self.frame_shape))
+        if t is None:
+            t = len(self._steps)
+        if values.size > 0:
+            step = (float(t), float(values.min()), float(values.max()),
+                    float(np.linalg.norm(values.ravel())))
+        else:
+            step = (float(t), 0.0, 0.0, 0.0)
+        # write the data before the step line:
+        self._fd.write(values.data)
+        self._fd.flush()
+        self._fs.write('%r %r %r %r\n' % step)
+        self._fs.flush()
+        self._steps.append(step)
+
+    def refresh(self):
+        """Read the steps added (by another writer) since the last read."""
+        self._steps = self._read_steps()
+
+    def __len__(self):
+        return len(self._steps)
+
+    def _get_values(self):
+        n = len(self._steps)
+        if self._values is None or self._values.shape[0] != n:
+            if n == 0:
+                self._values = np.zeros((0,) + self.frame_shape, self.dtype)
+            else:
+                self._values = np.memmap(self._datfile, dtype=self.dtype,
+                                         mode='r', shape=(n,) +
+                                         self.frame_shape)
+        return self._values
+
+    values = property(_get_values, doc='memory-mapped array of all frames')
+
+    def _column(self, i):
+        return np.array([step[i] for step in self._steps])
+
+    times = property(lambda self: self._column(0), doc='time values')
+    min = property(lambda self: self._column(1), doc='minimum of each frame')
+    max = property(lambda self: self._column(2), doc='maximum of each frame')
+    norm = property(lambda self: self._column(3), doc='norm of each frame')
+
+    def __getitem__(self, index):
+        """
+        series[i] is a BoxField with frame no i (the values are a
+        read-only view of the file). Other indices (slices of frames,
+        or a frame index followed by indices in space) give the
+        corresponding (memory-mapped) part of self.values.
+        """
+        if isinstance(index, (int, np.integer)):
+            return self.field(index)
+        return self.values[index]
+
+    def field(self, i):
+        """Return frame no i as a BoxField."""
+        return BoxField(self.grid, self.name, vector=self.vector,
+                        values=self.values[i])
+
+    def time_index(self, t):
+        """Return the index of the frame with time closest to t."""
+        return int(np.abs(self.times - t).argmin())
+
+    def close(self):
+        for f in self._fd, self._fs:
+            if f is not None:
+                f.close()
+        self._fd = self._fs = None
+        self._values = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self):
+        return '%s: %d frames of %s over %s' % \
+            (self.filename, len(self), self.name, self.grid)
+
+
+def _grid2dict(grid):
+    """Return the data needed to reconstruct grid as a dict."""
+    if isinstance(grid, BoxGrid):
+        return {'coor': [c.tolist() for c in grid.coor],
+                'dirnames': tuple(grid.dirnames)}
+    return {'min': grid.min_coor.tolist(), 'max': grid.max_coor.tolist(),
+            'division': list(grid.division),
+            'dirnames': tuple(grid.dirnames)}
+
+
+def _dict2grid(d):
+    """Inverse of _grid2dict."""
+    if 'coor' in d:
+        return BoxGrid([np.array(c) for c in d['coor']],
+                       dirnames=d['dirnames'])
+    return UniformBoxGrid(min=d['min'], max=d['max'],
+                          division=d['division'], dirnames=d['dirnames'])
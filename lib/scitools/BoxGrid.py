@@ -5,7 +5,7 @@ Class for uniform and non-uniform grid on an interval, rectangle, or box.
 
 
 from scitools.errorcheck import right_type, wrong_type
-from scitools.numpyutils import ndgrid, wrap2callable
+from scitools.numpyutils import ndgrid
 import numpy as np
 
 # constants for indexing the space directions:
@@ -36,21 +36,33 @@ class UniformBoxGrid(object):
                        (in 2D, self.coorv[0] = self.coor[0][:,newaxis])
     tolerance          small geometric tolerance based on grid coordinates
     npoints            total number of grid points
+    nbytes             no of bytes in the coordinate arrays
     =============      ====================================================
 
+    The coorv arrays (and in 3D the boundary coordinate arrays
+    xcoorv_yfixed_boundary, zcoorv_yfixed_boundary, etc.) are made
+    the first time they are used. They are sparse (broadcastable)
+    arrays, unless the constructor argument dense_coorv is true,
+    which gives arrays of the same shape as the grid.
+    The coordinates can also be accessed by the nicknames xcoor,
+    ycoor, xcoorv, ycoorv, etc. (based on dirnames).
+
     """
 
     def __init__(self,
                  min=(0, 0),                  # minimum coordinates
                  max=(1, 1),                  # maximum coordinates
                  division=(4, 4),             # cell divisions
-                 dirnames=('x', 'y', 'z')):  # names of the directions
+                 dirnames=('x', 'y', 'z'),    # names of the directions
+                 dense_coorv=False):          # full arrays in coorv
         """
         Initialize a BoxGrid by giving domain range (minimum and
         maximum coordinates: min and max tuples/lists/arrays)
         and number of cells in each space direction (division tuple/list/array).
         The dirnames tuple/list holds the names of the coordinates in
-        the various spatial directions.
+        the various spatial directions. If dense_coorv is true,
+        the coorv arrays have the shape of the grid, otherwise they
+        are sparse arrays (e.g. of shape (nx+1,1) and (1,ny+1) in 2D).
 
         >>> g = UniformBoxGrid(min=0, max=1, division=10)
         >>> g = UniformBoxGrid(min=(0,-1), max=(1,1), division=(10,4))
@@ -83,6 +95,7 @@ class UniformBoxGrid(object):
         self.max_coor = np.array(max, float)
         self.dirnames = dirnames
         self.division = division
+        self.dense_coorv = dense_coorv
         self.coor = [None] * self.nsd
         self.shape = [0] * self.nsd
         self.delta = np.zeros(self.nsd)
@@ -97,10 +110,11 @@ class UniformBoxGrid(object):
 
     def _more_init(self):
         self.shape = tuple(self.shape)
-        self.coorv = ndgrid(*self.coor)
-        if not isinstance(self.coorv, (list, tuple)):
-            # 1D grid, wrap self.coorv as list:
-            self.coorv = [self.coorv]
+        # coorv and boundary coordinates are computed when needed
+        # (see the coorv property and __getattr__):
+        self._coorv = None
+        self._boundary_coorv = {}
+        self._slices_cache = {}  # see the slices and indices methods
 
         self.npoints = 1
         for i in range(len(self.shape)):
@@ -108,24 +122,57 @@ class UniformBoxGrid(object):
 
         self.tolerance = (max(self.max_coor) - min(self.min_coor)) * 1E-14
 
-        # nicknames: xcoor, ycoor, xcoorv, ycoorv, etc
-        for i in range(self.nsd):
-            self.__dict__[self.dirnames[i] + 'coor'] = self.coor[i]
-            self.__dict__[self.dirnames[i] + 'coorv'] = self.coorv[i]
+    def _get_coorv(self):
+        if self._coorv is None:
+            coorv = ndgrid(*self.coor, sparse=not self.dense_coorv)
+            if not isinstance(coorv, (list, tuple)):
+                # 1D grid, wrap coorv as list:
+                coorv = [coorv]
+            self._coorv = list(coorv)
+        return self._coorv
+
+    coorv = property(_get_coorv,
+                     doc='coordinate arrays for vectorized expressions')
 
-        if self.nsd == 3:
-            # make boundary coordinates for vectorization:
-            xdummy, \
-                self.ycoorv_xfixed_boundary, \
-                self.zcoorv_xfixed_boundary = ndgrid(0, self.ycoor, self.zcoor)
+    def _get_nbytes(self):
+        arrays = list(self.coor) + list(self._boundary_coorv.values())
+        if self._coorv is not None:
+            arrays += self._coorv
+        return sum([a.nbytes for a in arrays])
 
-            self.xcoorv_yfixed_boundary, \
-                ydummy, \
-                self.zcoorv_yfixed_boundary = ndgrid(self.xcoor, 0, self.zcoor)
+    nbytes = property(_get_nbytes,
+                      doc='no of bytes in the (computed) coordinate arrays')
 
-            self.xcoorv_yfixed_boundary, \
-                self.zcoorv_yfixed_boundary, \
-                zdummy = ndgrid(self.xcoor, self.ycoor, 0)
+    def __getattr__(self, name):
+        """
+        Nicknames xcoor, ycoor, xcoorv, ycoorv, etc, and in 3D the
+        coordinates for vectorization over the boundaries,
+        e.g., ycoorv_xfixed_boundary and zcoorv_xfixed_boundary
+        (the y and z coordinates in a plane x=const).
+        """
+        dirnames = self.__dict__.get('dirnames')
+        if dirnames is None or name.startswith('_'):
+            raise AttributeError(name)
+        for i, dirname in enumerate(dirnames):
+            if name == dirname + 'coor':
+                return self.coor[i]
+            elif name == dirname + 'coorv':
+                return self.coorv[i]
+        if self.nsd == 3 and name.endswith('fixed_boundary'):
+            if name not in self._boundary_coorv:
+                for j, fixed in enumerate(dirnames):
+                    coor = list(self.coor)
+                    coor[j] = 0
+                    coorv = ndgrid(*coor, sparse=not self.dense_coorv)
+                    for i, dirname in enumerate(dirnames):
+                        if i != j:
+                            self._boundary_coorv[
+                                '%scoorv_%sfixed_boundary' %
+                                (dirname, fixed)] = coorv[i]
+            if name in self._boundary_coorv:
+                return self._boundary_coorv[name]
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, name))
 
     # could have _ in all variable names and define read-only
     # access via properties
@@ -276,7 +323,9 @@ class UniformBoxGrid(object):
         Given a self.nsd dimension array point_values with
         values at each grid point, this method returns a function
         for interpolating the scalar field defined by point_values
-        at an arbitrary point.
+        at an arbitrary point (or arrays of points). Vector fields,
+        where point_values has the component axis first, are also
+        supported. The interpolation is done by the interpolate method.
 
         2D Example:
         given a filled array point_values[i,j], compute
@@ -299,10 +348,12 @@ class UniformBoxGrid(object):
         >>> f(0.1,0.234)        # exact answer
         1.9660000000000002
         """
-        args = self.coor
-        args.append(point_values)
-        # make use of wrap2callable, which applies ScientificPython
-        return wrap2callable(args)
+        def interpolate(*x):
+            x = np.broadcast_arrays(*[np.asarray(c, float) for c in x])
+            points = np.column_stack([c.ravel() for c in x])
+            v = self.interpolate(points, point_values)
+            return v.reshape(v.shape[:-1] + x[0].shape)[()]
+        return interpolate
 
     def vectorized_eval(self, f):
         """
@@ -327,6 +378,12 @@ class UniformBoxGrid(object):
          [ 2.  2.  2.  2.]]
         """
         a = f(*self.coorv)
+        if isinstance(a, np.ndarray) and a.shape != self.shape:
+            # f may depend on some of the (sparse) coordinates only
+            try:
+                a = np.broadcast_to(a, self.shape).copy()
+            except ValueError:
+                pass  # wrong shape, reported by self.compatible
 
         # check if f is really vectorized:
         try:
@@ -377,124 +434,127 @@ class UniformBoxGrid(object):
         objects for the index slice in each direction.
         vectorized_version is false if the iterator visits each point
         at a time (scalar version).
+
+        The slices are computed once for each domain part (see the
+        slices method). For assignments to all points in a domain part,
+        the flat indices from the indices method are more efficient.
         """
+        self.slices(domain_part)  # check domain_part
         self.iterator_domain = domain_part
         self.vectorized_iter = vectorized_version
         return self
 
-    def __iter__(self):
-        # Idea: set up slices for the various self.iterator_domain
-        # values. In scalar mode, make a loop over the slices and
-        # yield the scalar value. In vectorized mode, return the
-        # appropriate slices.
-
-        self._slices = []  # elements meant to be slice objects
-
-        if self.iterator_domain == 'all':
-            self._slices.append([])
-            for i in range(self.nsd):
-                self._slices[-1].append((i, slice(0, len(self.coor[i]), 1)))
-
-        elif self.iterator_domain == 'interior':
-            self._slices.append([])
-            for i in range(self.nsd):
-                self._slices[-1].append((i, slice(1, len(self.coor[i]) - 1, 1)))
+    def slices(self, domain_part='all'):
+        """
+        Return a tuple of index tuples, one for each part of
+        domain_part (see iter), where an index tuple has a slice
+        for each space direction. The tuples are cached.
 
-        elif self.iterator_domain == 'all_boundary':
+        >>> g = UniformBoxGrid(min=(0,0), max=(1,1), division=(3,2))
+        >>> g.slices('interior')
+        ((slice(1, 3, 1), slice(1, 2, 1)),)
+        """
+        if domain_part not in self._slices_cache:
+            self._slices_cache[domain_part] = \
+                tuple(self._make_slices(domain_part))
+        return self._slices_cache[domain_part]
+
+    def _make_slices(self, domain_part):
+        """Return a list of index tuples for domain_part."""
+        n = [len(c) for c in self.coor]
+        all_ = [slice(0, n[i], 1) for i in range(self.nsd)]
+        interior = [slice(1, n[i] - 1, 1) for i in range(self.nsd)]
+        lower = [slice(0, 1, 1) for i in range(self.nsd)]
+        upper = [slice(n[i] - 1, n[i], 1) for i in range(self.nsd)]
+        slices = []
+
+        if domain_part == 'all':
+            slices.append(tuple(all_))
+
+        elif domain_part == 'interior':
+            slices.append(tuple(interior))
+
+        elif domain_part in ('all_boundary', 'interior_boundary'):
+            other = all_ if domain_part == 'all_boundary' else interior
             for i in range(self.nsd):
-                self._slices.append([])
-                # boundary i fixed at 0:
-                for j in range(self.nsd):
-                    if j != i:
-                        self._slices[-1].\
-                            append((j, slice(0, len(self.coor[j]), 1)))
-                    else:
-                        self._slices[-1].append((i, slice(0, 1, 1)))
-                # boundary i fixed at its max value:
-                for j in range(self.nsd):
-                    if j != i:
-                        self._slices[-1].\
-                            append((j, slice(0, len(self.coor[j]), 1)))
-                    else:
-                        n = len(self.coor[i])
-                        self._slices[-1].append((i, slice(n - 1, n, 1)))
-
-        elif self.iterator_domain == 'interior_boundary':
+                # boundary i fixed at 0 and at its max value:
+                for fixed in lower, upper:
+                    s = other[:]
+                    s[i] = fixed[i]
+                    slices.append(tuple(s))
+
+        elif domain_part == 'corners':
+            for corner in np.ndindex(*([2] * self.nsd)):
+                slices.append(tuple([(lower, upper)[c][i]
+                                     for i, c in enumerate(corner)]))
+
+        elif domain_part in ('all_edges', 'interior_edges'):
+            # an edge goes along direction i, all other directions
+            # are fixed at 0 or at their max values:
+            along = all_ if domain_part == 'all_edges' else interior
             for i in range(self.nsd):
-                self._slices.append([])
-                # boundary i fixed at 0:
-                for j in range(self.nsd):
-                    if j != i:
-                        self._slices[-1].\
-                            append((j, slice(1, len(self.coor[j]) - 1, 1)))
-                    else:
-                        self._slices[-1].append((i, slice(0, 1, 1)))
-                # boundary i fixed at its max value:
-                for j in range(self.nsd):
-                    if j != i:
-                        self._slices[-1].\
-                            append((j, slice(1, len(self.coor[j]) - 1, 1)))
-                    else:
-                        n = len(self.coor[i])
-                        self._slices[-1].append((i, slice(n - 1, n, 1)))
-
-        elif self.iterator_domain == 'corners':
-            if self.nsd == 1:
-                for i0 in (0, len(self.coor[0]) - 1):
-                    self._slices.append([])
-                    self._slices[-1].append((0, slice(i0, i0 + 1, 1)))
-            elif self.nsd == 2:
-                for i0 in (0, len(self.coor[0]) - 1):
-                    for i1 in (0, len(self.coor[1]) - 1):
-                        self._slices.append([])
-                        self._slices[-1].append((0, slice(i0, i0 + 1, 1)))
-                        self._slices[-1].append((0, slice(i1, i1 + 1, 1)))
-            elif self.nsd == 3:
-                for i0 in (0, len(self.coor[0]) - 1):
-                    for i1 in (0, len(self.coor[1]) - 1):
-                        for i2 in (0, len(self.coor[2]) - 1):
-                            self._slices.append([])
-                            self._slices[-1].append((0, slice(i0, i0 + 1, 1)))
-                            self._slices[-1].append((0, slice(i1, i1 + 1, 1)))
-                            self._slices[-1].append((0, slice(i2, i2 + 1, 1)))
-
-        elif self.iterator_domain == 'all_edges':
-            print('iterator over "all_edges" is not implemented')
-        elif self.iterator_domain == 'interior_edges':
-            print('iterator over "interior_edges" is not implemented')
+                for corner in np.ndindex(*([2] * (self.nsd - 1))):
+                    corner = list(corner)
+                    corner.insert(i, 0)
+                    s = [(lower, upper)[c][j] for j, c in enumerate(corner)]
+                    s[i] = along[i]
+                    slices.append(tuple(s))
         else:
-            raise ValueError('iterator over "%s" is not impl.' %
-                             self.iterator_domain)
+            raise ValueError('iterator over "%s" is not impl.' % domain_part)
+        return slices
+
+    def indices(self, domain_part='all'):
+        """
+        Return the (sorted, unique) flat indices of the grid points
+        in domain_part (see iter), as a read-only array. Useful for
+        setting boundary values in one operation::
+
+            u.ravel()[grid.indices('all_boundary')] = 0
+
+        (u.ravel() is a view of a contiguous array u.) The indices
+        are cached.
+        """
+        key = ('indices', domain_part)
+        if key not in self._slices_cache:
+            index = []
+            for s in self.slices(domain_part):
+                grid_index = np.ix_(*[np.arange(si.start, si.stop, si.step)
+                                      for si in s])
+                index.append(np.ravel_multi_index(grid_index,
+                                                  self.shape).ravel())
+            if index:
+                index = np.unique(np.concatenate(index))
+            else:
+                index = np.zeros(0, int)
+            index.flags.writeable = False
+            self._slices_cache[key] = index
+        return self._slices_cache[key]
 
-#    "def __next__(self):"
+    def __iter__(self):
         """
         If vectorized mode:
-        Return list of slice instances, where the i-th element in the
-        list represents the slice for the index in the i-th space
+        Return tuple of slice instances, where the i-th element in the
+        tuple represents the slice for the index in the i-th space
         direction (0,...,nsd-1).
 
         If scalar mode:
-        Return list of indices (in multi-D) or the index (in 1D).
+        Return tuple of indices (in multi-D) or the index (in 1D).
         """
+        slices = self.slices(self.iterator_domain)
         if self.vectorized_iter:
-            for s in self._slices:
-                yield [slice_in_dir for dir, slice_in_dir in s]
+            for s in slices:
+                yield s
         else:
             # scalar version
-            for s in self._slices:
-                slices = [slice_in_dir for dir, slice_in_dir in s]
-                if len(slices) == 1:
-                    for i in range(slices[0].start, slices[0].stop):
+            for s in slices:
+                if len(s) == 1:
+                    for i in range(s[0].start, s[0].stop):
                         yield i
-                elif len(slices) == 2:
-                    for i in range(slices[0].start, slices[0].stop):
-                        for j in range(slices[1].start, slices[1].stop):
-                            yield [i, j]
-                elif len(slices) == 3:
-                    for i in range(slices[0].start, slices[0].stop):
-                        for j in range(slices[1].start, slices[1].stop):
-                            for k in range(slices[2].start, slices[2].stop):
-                                yield [i, j, k]
+                else:
+                    for index in np.ndindex(*[si.stop - si.start
+                                              for si in s]):
+                        yield tuple([si.start + i
+                                     for si, i in zip(s, index)])
 
     def locate_cell(self, point):
         """
@@ -512,7 +572,6 @@ class UniformBoxGrid(object):
         element in the distance array is then set 0.
         4) the indices of the nearest grid point.
 
-        The method only works for uniform grid spacing.
         Used for interpolation.
 
         >>> g1 = UniformBoxGrid(min=0, max=1, division=4)
@@ -542,41 +601,125 @@ class UniformBoxGrid(object):
         """
         if isinstance(point, (int, float)):
             point = [point]
-        nsd = len(point)
-        if nsd != self.nsd:
+        if len(point) != self.nsd:
             raise ValueError('point=%s has wrong dimension (this is a %dD grid!)' %
                              (point, self.nsd))
-        # index = np.zeros(nsd, int)
-        index = [0] * nsd
-        distance = np.zeros(nsd)
-        grid_point = [False] * nsd
-        nearest_point = [0] * nsd
-        for i, coor in enumerate(point):
-            # is point inside the domain?
-            if coor < self.min_coor[i] or coor > self.max_coor[i]:
-                raise ValueError(
-                    'locate_cell: point=%s is outside the domain [%s,%s]' %
-                    point, self.min_coor[i], self.max_coor[i])
-            index[i] = int((coor - self.min_coor[i]) // self.delta[i])  # (need integer division)
-            distance[i] = coor - (self.min_coor[i] + index[i] * self.delta[i])
-            if distance[i] > self.delta[i] / 2:
-                nearest_point[i] = index[i] + 1
-            else:
-                nearest_point[i] = index[i]
-            if abs(distance[i]) < self.tolerance:
-                grid_point[i] = True
-                nearest_point[i] = index[i]
-            if (abs(distance[i] - self.delta[i])) < self.tolerance:
-                # last cell, update index such that it coincides with the point
-                grid_point[i] = True
-                index[i] += 1
-                nearest_point[i] = index[i]
-                distance[i] = 0.0
+        index, distance, grid_point, nearest_point = \
+            self.locate_cells([point])
+        return index[0].tolist(), distance[0], grid_point[0].tolist(), \
+            nearest_point[0].tolist()
+
+    def locate_cells(self, points):
+        """
+        Vectorized version of locate_cell for n points given as an
+        array of shape (n, nsd) (or (n,) in 1D). The four return values
+        of locate_cell are returned as arrays of shape (n, nsd).
 
+        >>> g2 = UniformBoxGrid.init_fromstring('[-1,1]x[-1,2] [0:3]x[0:4]')
+        >>> index, distance, match, nearest = \\
+        ...        g2.locate_cells([(0.2,0.2), (1,2)])
+        >>> index
+        array([[1, 1],
+               [3, 4]])
+        """
+        points = self._points(points)
+        n = points.shape[0]
+        index = np.empty((n, self.nsd), int)
+        distance = np.empty((n, self.nsd))
+        grid_point = np.empty((n, self.nsd), bool)
+        nearest_point = np.empty((n, self.nsd), int)
+        for i in range(self.nsd):
+            cell, dist, width = self._locate_axis(i, points[:, i])
+            at_lower = np.abs(dist) < self.tolerance
+            at_upper = np.abs(dist - width) < self.tolerance
+            nearest = np.where(dist > width / 2, cell + 1, cell)
+            # a point on the upper grid line of the cell gets the
+            # index of that grid line and zero distance:
+            cell = np.where(at_upper, cell + 1, cell)
+            index[:, i] = cell
+            distance[:, i] = np.where(at_upper, 0.0, dist)
+            grid_point[:, i] = at_lower | at_upper
+            nearest_point[:, i] = np.where(grid_point[:, i], cell, nearest)
         return index, distance, grid_point, nearest_point
 
-    def interpolate(v0, v1, x0, x1, x):
-        return v0 + (v1 - v0) / float(x1 - x0) * (x - x0)
+    def _points(self, points):
+        """
+        Return points as an (n, nsd) float array, and check that all
+        points are inside the grid.
+        """
+        points = np.asarray(points, float)
+        if points.ndim == 1 and self.nsd == 1:
+            points = points.reshape(-1, 1)
+        if points.ndim != 2 or points.shape[1] != self.nsd:
+            raise ValueError('points must have shape (n, %d), not %s' %
+                             (self.nsd, points.shape))
+        outside = np.logical_or(
+            points < self.min_coor - self.tolerance,
+            points > self.max_coor + self.tolerance).any(axis=1)
+        if outside.any():
+            raise ValueError('%d points are outside the domain %s, e.g. %s' %
+                             (outside.sum(), self, points[outside][0]))
+        return points
+
+    def _locate_axis(self, i, x):
+        """
+        Locate the coordinates x (array) in direction i. Return the
+        index of the cell (the index of its lower grid point, at most
+        division[i]-1), the distance from that grid point, and the
+        cell width (a number, or an array if the spacing varies).
+        Subclasses override this method for other types of grids.
+        """
+        cell = np.floor((x - self.min_coor[i]) / self.delta[i]).astype(int)
+        np.clip(cell, 0, self.division[i] - 1, out=cell)
+        return cell, x - (self.min_coor[i] + cell * self.delta[i]), \
+            self.delta[i]
+
+    def interpolate(self, points, values):
+        """
+        Multi-linear interpolation of values (array over the grid
+        points) at n points given as an array of shape (n, nsd).
+        A vector field (values with extra leading component axes,
+        like the values of a BoxField with vector=ncomponents) gives
+        the interpolated components, with shape
+        values.shape[:-nsd] + (n,).
+
+        >>> g = UniformBoxGrid(min=(0,-1), max=(2,1), division=(2,2))
+        >>> f = g.vectorized_eval(lambda x, y: 2 + 2*x - y)
+        >>> g.interpolate([(0.1, 0.234), (2, 1)], f)
+        array([1.966, 5.   ])
+        """
+        values = np.asarray(values)
+        if values.shape[values.ndim - self.nsd:] != tuple(self.shape):
+            raise IndexError("values of shape %s are not compatible with "
+                             "the grid's shape %s" %
+                             (values.shape, self.shape))
+        points = self._points(points)
+        n = points.shape[0]
+        component_shape = values.shape[:values.ndim - self.nsd]
+        values = values.reshape(component_shape + (-1,))
+
+        cells = []
+        weights = []
+        for i in range(self.nsd):
+            cell, dist, width = self._locate_axis(i, points[:, i])
+            cells.append(cell)
+            weights.append(np.clip(dist / width, 0.0, 1.0))
+
+        # sum over the 2**nsd corners of the cells:
+        result = np.zeros(component_shape + (n,))
+        for corner in range(2**self.nsd):
+            index = []
+            w = np.ones(n)
+            for i in range(self.nsd):
+                if (corner >> i) & 1:
+                    index.append(cells[i] + 1)
+                    w *= weights[i]
+                else:
+                    index.append(cells[i])
+                    w *= 1 - weights[i]
+            flat = np.ravel_multi_index(index, self.shape)
+            result += w * values[..., flat]
+        return result
 
     def gridline_slice(self, start_coor, direction=0, end_coor=None):
         """
@@ -672,22 +815,31 @@ class BoxGrid(UniformBoxGrid):
     grid coordinates in that space direction (stored as an array).
     """
 
-    def __init__(self, coor, dirnames=('x', 'y', 'z')):
+    def __init__(self, coor, dirnames=('x', 'y', 'z'), dense_coorv=False):
 
         UniformBoxGrid.__init__(self,
                                 min=[a[0] for a in coor],
                                 max=[a[-1] for a in coor],
                                 division=[len(a) - 1 for a in coor],
-                                dirnames=dirnames)
+                                dirnames=dirnames,
+                                dense_coorv=dense_coorv)
         # override:
-        self.coor = coor
+        self.coor = [np.asarray(c, float) for c in coor]
 
     def __repr__(self):
         s = self.__class__.__name__ + '(coor=%s)' % self.coor
         return s
 
-    def locate_cell(self, point):
-        raise NotImplementedError('Cannot locate point in cells in non-uniform grids')
+    def _locate_axis(self, i, x):
+        """
+        As UniformBoxGrid._locate_axis, but with a binary search
+        (numpy.searchsorted) among the coordinates in direction i.
+        The returned cell widths are arrays.
+        """
+        c = self.coor[i]
+        cell = np.searchsorted(c, x, side='right') - 1
+        np.clip(cell, 0, len(c) - 2, out=cell)
+        return cell, x - c[cell], c[cell + 1] - c[cell]
 
 
 def _test(g, points=None):
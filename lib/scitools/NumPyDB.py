@@ -4,18 +4,96 @@ Efficient database for NumPy objects.
 """
 
 
-import sys, os, pickle, re
+import sys, os, pickle, re, time
 from scitools.numpytools import *
 
 class NumPyDB:
-    def __init__(self, database_name, mode='store'):
+    def __init__(self, database_name, mode='store', numeric_key=None,
+                 batch_size=64, batch_bytes=2**24, flush_interval=None,
+                 fsync=False):
+        """
+        Open a database for storing ('store' mode) or loading
+        ('load' mode) NumPy arrays.
+
+        numeric_key turns on a numeric index of the identifiers
+        in 'load' mode: it is either a function mapping an
+        identifier string to a number (e.g., a time value), or
+        True, which means numeric_identifier (the last number in
+        the identifier). Best-approximation lookups are then
+        binary searches for the nearest number, and locate_range
+        finds all records with numbers in an interval.
+
+        Used in a with statement, the database keeps its files open
+        and dump collects records in an in-memory batch::
+
+            with NumPyDB_cPickle('mydata', 'store') as db:
+                db.dump(a, 'time=%g' % t)
+
+        A batch is written when it holds batch_size records or
+        batch_bytes bytes, when flush_interval seconds have passed
+        since the last write (checked in dump), and when flush or
+        close is called (close is called at the end of the with
+        block). The data of a batch are written (and, if fsync is
+        true, synced to disk) before the corresponding lines are
+        appended to the map file, so a crash can at most lose the
+        last batch, never leave map entries pointing to missing data.
+        (An incomplete last line in the map file, from a writer that
+        crashed, is removed by the next writer.)
+        Without a with statement (or open), each dump opens, appends
+        to and closes the files.
+
+        The mode 'append' works as 'store', but keeps the records
+        already in the database. One process at a time can write to
+        a database (a writer holds an exclusive lock on the map
+        file), while any number of processes can read it
+        concurrently: a reader in 'load' mode calls refresh to pick
+        up the records published after it opened the database.
+        Since data are written before map lines, and only complete
+        lines in the map file are read, a reader never sees a record
+        whose data are not completely written. Opening a database in
+        'store' mode (which empties it) while a writer is active
+        raises IOError:
+
+        >>> import tempfile
+        >>> name = os.path.join(tempfile.mkdtemp(), 'locked')
+        >>> with NumPyDB_pickle(name, 'store') as writer:
+        ...     writer.dump(np.zeros(2), 't=0')
+        ...     NumPyDB_pickle(name, 'store')
+        Traceback (most recent call last):
+        ...
+        OSError: ...locked.map is locked by another writer
+        >>> [id for pos, id in NumPyDB_pickle(name, 'load').positions]
+        ['t=0']
+        """
         self.filename = database_name
         self.dn = self.filename + '.dat' # NumPy array data
         self.pn = self.filename + '.map' # positions & identifiers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._fd = self._fm = None  # open files (in a with statement)
+        self._batch = []            # (record, identifier) to be written
+        self._batch_nbytes = 0
+        self._flush_time = time.time()
         if mode == 'store':
-            # bring files into existence:
-            fd = open(self.dn, 'w');  fd.close()
-            fm = open(self.pn, 'w');  fm.close()
+            # bring files into existence (empty), but not while
+            # another writer holds the lock on the map file:
+            fm = open(self.pn, 'a')
+            try:
+                try:
+                    _lock(fm, blocking=False)
+                except IOError:
+                    raise IOError('%s is locked by another writer' %
+                                  self.pn)
+                fd = open(self.dn, 'w');  fd.close()
+                fm.truncate(0)
+            finally:
+                fm.close()  # (releases the lock)
+        elif mode == 'append':
+            fd = open(self.dn, 'a');  fd.close()
+            fm = open(self.pn, 'a');  fm.close()
         elif mode == 'load':
             # check if files are there:
             if not os.path.isfile(self.dn) or \
@@ -23,18 +101,136 @@ class NumPyDB:
                 raise IOError("Could not find the files %s and %s" %\
                               (self.dn, self.pn))
             # load mapfile into list of tuples:
-            fm = open(self.pn, 'r')
-            lines = fm.readlines()
-            self.positions = []
-            for line in lines:
-                # first column contains file positions in the
-                # file .dat for direct access, the rest of the
-                # line is an identifier
-                c = line.split()
-                # append tuple (position, identifier):
-                self.positions.append((int(c[0]),
-                                       ' '.join(c[1:]).strip()))
-            fm.close()
+            self._map_offset = 0  # no of bytes read from the map file
+            self.positions = self._read_map()
+        else:
+            raise ValueError('mode="%s" is illegal' % mode)
+        self._numeric = None
+        if numeric_key and mode == 'load':
+            self._numeric = _NumericIndex(
+                [id for pos, id in self.positions], self.positions,
+                numeric_key)
+
+    def _read_map(self):
+        """
+        Return a list of (position, identifier) tuples from the
+        lines in the map file that are not read yet. An incomplete
+        last line (from a writer that crashed or is still writing)
+        is left for the next call.
+        """
+        fm = open(self.pn, 'rb')
+        fm.seek(self._map_offset)
+        text = fm.read()
+        fm.close()
+        text = text[:text.rfind(b'\n') + 1]  # complete lines only
+        self._map_offset += len(text)
+        positions = []
+        for line in text.decode().splitlines():
+            # first column contains file positions in the
+            # file .dat for direct access, the rest of the
+            # line is an identifier
+            c = line.split()
+            # append tuple (position, identifier):
+            positions.append((int(c[0]), ' '.join(c[1:]).strip()))
+        return positions
+
+    def refresh(self):
+        """
+        Read the records that a writer has added since the
+        database was opened (or last refreshed) in 'load' mode.
+        Return the list of new (position, identifier) tuples.
+        """
+        positions = self._read_map()
+        self.positions.extend(positions)
+        if self._numeric is not None:
+            self._numeric.add([id for pos, id in positions], positions)
+        return positions
+
+    def open(self):
+        """Open the files for a sequence of (batched) dumps."""
+        if self._fd is None and self.mode in ('store', 'append'):
+            self._fm = open(self.pn, 'a')
+            try:
+                _lock(self._fm, blocking=False)
+            except IOError:
+                self._fm.close();  self._fm = None
+                raise IOError('%s is locked by another writer' % self.pn)
+            _remove_incomplete_line(self._fm)
+            self._fd = open(self.dn, 'ab')
+            self._flush_time = time.time()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def flush(self):
+        """Write the records in the current batch to file."""
+        if self._batch:
+            self._write(self._batch, self._fd, self._fm)
+            self._batch = []
+            self._batch_nbytes = 0
+        self._flush_time = time.time()
+
+    def close(self):
+        """Write the current batch and close the files."""
+        if self._fd is not None:
+            try:
+                self.flush()
+            finally:
+                self._fd.close();  self._fm.close()  # (releases the lock)
+                self._fd = self._fm = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _write(self, records, fd, fm):
+        """
+        Append a list of (record, identifier) pairs to the open
+        data file fd and map file fm.
+        """
+        lines = []
+        pos = fd.tell()
+        for record, identifier in records:
+            lines.append("%d\t\t %s\n" % (pos, identifier))
+            pos += len(record)
+        fd.write(b''.join([record for record, identifier in records]))
+        fd.flush()
+        if self.fsync:
+            os.fsync(fd.fileno())
+        # publish the records in the map file when the data are written:
+        fm.write(''.join(lines))
+        fm.flush()
+        if self.fsync:
+            os.fsync(fm.fileno())
+
+    def dump(self, a, identifier):
+        """Dump NumPy array a with identifier."""
+        record = self._record(a)
+        if self._fd is None:
+            fm = open(self.pn, 'a')
+            _lock(fm)
+            _remove_incomplete_line(fm)
+            fd = open(self.dn, 'ab')
+            self._write([(record, identifier)], fd, fm)
+            fd.close();  fm.close()
+            return
+        self._batch.append((record, identifier))
+        self._batch_nbytes += len(record)
+        if len(self._batch) >= self.batch_size or \
+           self._batch_nbytes >= self.batch_bytes or \
+           (self.flush_interval is not None and
+            time.time() - self._flush_time >= self.flush_interval):
+            self.flush()
+
+    def _record(self, a):  # empty base class func.
+        """Return the bytes representing NumPy array a in the .dat file."""
+        raise NameError("_record is not implemented; must be impl. in subclass")
 
     def locate(self, identifier, bestapprox=None): # base class
         """
@@ -44,6 +240,16 @@ class NumPyDB:
         the distance between two identifiers.
         """
         identifier = identifier.strip()
+        if self._numeric is not None:
+            # exact match by dictionary lookup, best approximation
+            # by binary search among the numeric identifiers
+            # (the numeric distance replaces the bestapprox function):
+            item = self._numeric.exact(identifier)
+            if item is None and bestapprox is not None:
+                item = self._numeric.nearest(identifier)
+            if item is None:
+                return -1, None
+            return item
         # first search for an exact identifier match:
         selected_pos = -1
         selected_id = None
@@ -62,9 +268,17 @@ class NumPyDB:
                         min_dist = d
         return selected_pos, selected_id
 
-    def dump(self, a, identifier):  # empty base class func.
-        """Dump NumPy array a with identifier."""
-        raise NameError("dump is not implemented; must be impl. in subclass")
+    def locate_range(self, lower, upper):
+        """
+        Return a list of (position, identifier) tuples for all
+        records whose numeric identifier lies in [lower, upper],
+        sorted with respect to the numeric identifier.
+        Requires the numeric_key argument in the constructor.
+        """
+        if self._numeric is None:
+            raise ValueError('locate_range requires a database opened '
+                             'with the numeric_key argument')
+        return self._numeric.range(lower, upper)
 
     def load(self, identifier, bestapprox=None):
         """Load NumPy array with identifier or find best approx."""
@@ -72,27 +286,41 @@ class NumPyDB:
 
 
 class NumPyDB_text(NumPyDB):
-    """Use plain ASCII string representation."""
+    """
+    Use plain ASCII string representation.
 
-    def __init__(self, database_name, mode='store'):
-        NumPyDB.__init__(self, database_name, mode)
+    A reader can load records while a writer appends new ones:
 
-    # simple dump:
-    def dump(self, a, identifier):
-        """Dump NumPy array a with identifier."""
-        fd = open(self.dn, 'a');  fm = open(self.pn, 'a')
-        fm.write("%d\t\t %s\n" % (fd.tell(), identifier))
-        fd.write(repr(a))
-        fd.close();  fm.close()
+    >>> import tempfile, os
+    >>> name = os.path.join(tempfile.mkdtemp(), 'text')
+    >>> writer = NumPyDB_text(name, 'append', batch_size=1)
+    >>> writer.open()
+    >>> writer.dump(np.array([1., 2.]), 'time=0')
+    >>> reader = NumPyDB_text(name, 'load')
+    >>> writer.dump(np.array([3., 4.]), 'time=1')
+    >>> f = open(name + '.dat', 'a')   # data of an unpublished record
+    >>> f.write('array([5.0,'); f.flush()
+    11
+    >>> [id for pos, id in reader.refresh()]
+    ['time=1']
+    >>> reader.load('time=1')
+    [array([3., 4.]), 'time=1']
+    >>> f.close(); writer.close()
+    """
 
-    # more efficient dump (due to Mario Pernici <Mario.Pernici@mi.infn.it>)
-    def dump(self, a, identifier):
-        """Dump NumPy array a with identifier."""
-        fd = open(self.dn, 'a');  fm = open(self.pn, 'a')
-        fm.write("%d\t\t %s\n" % (fd.tell(), identifier))
+    def __init__(self, database_name, mode='store', **kwargs):
+        NumPyDB.__init__(self, database_name, mode, **kwargs)
+
+    # simple record:
+    def _record(self, a):
+        """Return the text representation of NumPy array a."""
+        return repr(a).encode('ascii')
+
+    # more efficient record (due to Mario Pernici <Mario.Pernici@mi.infn.it>)
+    def _record(self, a):
+        """Return the text representation of NumPy array a."""
         fmt = 'array([' + '%s,'*(a.size-1) + '%s])\n'
-        fd.write(fmt % tuple(ravel(a)))
-        fd.close();  fm.close()
+        return (fmt % tuple(ravel(a))).encode('ascii')
 
 
     def load(self, identifier, bestapprox=None):
@@ -107,36 +335,45 @@ class NumPyDB_text(NumPyDB):
         if pos < 0: return [None, "not found"]
         fd = open(self.dn, 'r')
         fd.seek(pos)
-        # load the correct number of bytes; look at the next pos
-        # value in self.positions (impossible if a dictionary is
-        # used for self.positions - we need the order of the items!)
-        for j in range(len(self.positions)):
-            p = self.positions[j][0]
-            if p == pos:
-                try:
-                    s = fd.read(self.positions[j+1][0] - p)
-                except IndexError:
-                    # last self.positions entry reached,
-                    # just read the rest of the file:
-                    s = fd.read()
-                break
+        # a record is one line (reading to the end of the file would
+        # include data from a writer whose map lines are not yet
+        # published):
+        s = fd.readline()
         a = eval(s)
         fd.close()
         return [a, id]
 
 
 class NumPyDB_pickle (NumPyDB):
-    """Use basic Pickle class."""
+    """
+    Use basic Pickle class.
 
-    def __init__(self, database_name, mode='store'):
-        NumPyDB.__init__(self,database_name, mode)
+    A writer that crashed while writing the map file leaves an
+    incomplete last line, which the next writer removes:
 
-    def dump(self, a, identifier):
-        """Dump NumPy array a with identifier."""
-        fd = open(self.dn, 'a');  fm = open(self.pn, 'a')
-        fm.write("%d\t\t %s\n" % (fd.tell(), identifier))
-        pickle.dump(a, fd, 1)  # 1: binary storage
-        fd.close();  fm.close()
+    >>> import tempfile, os
+    >>> name = os.path.join(tempfile.mkdtemp(), 'pickle')
+    >>> with NumPyDB_pickle(name, 'store') as db:
+    ...     db.dump(np.zeros(2), 'time=0')
+    >>> f = open(name + '.map', 'a')
+    >>> n = f.write('99999\\t\\t time=0.')    # crash during the write
+    >>> f.close()
+    >>> with NumPyDB_pickle(name, 'append') as db:
+    ...     db.dump(np.ones(2), 'time=1')
+    ...     db.dump(2*np.ones(2), 'time=2')
+    >>> db = NumPyDB_pickle(name, 'load')
+    >>> [id for pos, id in db.positions]
+    ['time=0', 'time=1', 'time=2']
+    >>> db.load('time=2')
+    (array([2., 2.]), 'time=2')
+    """
+
+    def __init__(self, database_name, mode='store', **kwargs):
+        NumPyDB.__init__(self, database_name, mode, **kwargs)
+
+    def _record(self, a):
+        """Return NumPy array a as a pickle."""
+        return pickle.dumps(a, 1)  # 1: binary storage
 
     def load(self, identifier, bestapprox=None):
         """
@@ -148,7 +385,7 @@ class NumPyDB_pickle (NumPyDB):
         """
         pos, id = self.locate(identifier, bestapprox)
         if pos < 0: return None, "not found"
-        fd = open(self.dn, 'r')
+        fd = open(self.dn, 'rb')
         fd.seek(pos)
         a = pickle.load(fd)
         fd.close()
@@ -159,17 +396,12 @@ import pickle
 class NumPyDB_cPickle (NumPyDB):
     """Use basic cPickle class."""
 
-    def __init__(self, database_name, mode='store'):
-        NumPyDB.__init__(self,database_name, mode)
+    def __init__(self, database_name, mode='store', **kwargs):
+        NumPyDB.__init__(self, database_name, mode, **kwargs)
 
-    def dump(self, a, identifier):
-        """Dump NumPy array a with identifier."""
-        # fd: datafile, fm: mapfile
-        fd = open(self.dn, 'a');  fm = open(self.pn, 'a')
-        # fd.tell(): return current position in datafile
-        fm.write("%d\t\t %s\n" % (fd.tell(), identifier))
-        pickle.dump(a, fd, 1)  # 1: binary storage
-        fd.close();  fm.close()
+    def _record(self, a):
+        """Return NumPy array a as a pickle."""
+        return pickle.dumps(a, 1)  # 1: binary storage
 
     def load(self, identifier, bestapprox=None):
         """
@@ -181,39 +413,472 @@ class NumPyDB_cPickle (NumPyDB):
         """
         pos, id = self.locate(identifier, bestapprox)
         if pos < 0: return [None, "not found"]
-        fd = open(self.dn, 'r')
+        fd = open(self.dn, 'rb')
         fd.seek(pos)
         a = pickle.load(fd)
         fd.close()
         return [a, id]
 
 
+import ast, struct
+import numpy as np
+
+class NumPyDB_mmap (NumPyDB):
+    """
+    Store raw array bytes in the .dat file and load arrays as
+    memory-mapped views.
+
+    Each record in the .dat file consists of a small header (a magic
+    string, the header length and a dictionary with the dtype
+    description and the shape of the array) followed by the raw
+    array data. Records are padded such that the array data always
+    start at a multiple of _MMAP_ALIGN bytes.
+
+    In 'load' mode the whole .dat file is memory mapped once and a
+    dictionary maps each identifier to (offset, dtype, shape).
+    Loading an array with a known identifier is then a dictionary
+    lookup and returns a zero-copy, read-only np.memmap view
+    (take a copy if the array is to be modified).
+
+    >>> import tempfile, os
+    >>> name = os.path.join(tempfile.mkdtemp(), 'mmap')
+    >>> with NumPyDB_mmap(name, 'store') as db:
+    ...     db.dump(np.arange(6.).reshape(2,3), 'time=0')
+    ...     db.dump(np.arange(3, dtype=np.int16), 'time=1')
+    ...     db.dump(np.zeros((0, 2)), 'time=2')
+    >>> db = NumPyDB_mmap(name, 'load')
+    >>> a, id = db.load('time=0')
+    >>> a
+    memmap([[0., 1., 2.],
+            [3., 4., 5.]])
+    >>> a.flags.writeable, db._index[id][0] % _MMAP_ALIGN
+    (False, 0)
+    >>> db.load('time=1')
+    [memmap([0, 1, 2], dtype=int16), 'time=1']
+    >>> db.load('time=2')[0].shape
+    (0, 2)
+    >>> db.load('time=3')
+    [None, 'not found']
+
+    A reader sees records appended after it was created when it
+    calls refresh:
+
+    >>> with NumPyDB_mmap(name, 'append') as writer:
+    ...     writer.dump(np.ones(2), 'time=3')
+    >>> [id for pos, id in db.refresh()]
+    ['time=3']
+    >>> db.load('time=3')[0], float(a[1, 2])   # a is still valid
+    (memmap([1., 1.]), 5.0)
+    """
+
+    def __init__(self, database_name, mode='store', **kwargs):
+        NumPyDB.__init__(self, database_name, mode, **kwargs)
+        if mode == 'load':
+            self._index = {}  # identifier -> (offset, dtype, shape)
+            if os.path.getsize(self.dn) > 0:
+                self._buffer = np.memmap(self.dn, dtype=np.uint8, mode='r')
+            else:
+                self._buffer = None  # mmap of an empty file is illegal
+            self._add_to_index(self.positions)
+
+    def _add_to_index(self, positions):
+        for pos, id in positions:
+            if id not in self._index:  # first record wins, as in locate
+                self._index[id] = self._read_header(pos)
+
+    def refresh(self):
+        positions = NumPyDB.refresh(self)
+        if positions:
+            # the .dat file has grown, map it again (arrays loaded
+            # earlier keep their reference to the old map):
+            self._buffer = np.memmap(self.dn, dtype=np.uint8, mode='r')
+            self._add_to_index(positions)
+        return positions
+
+    def _read_header(self, pos):
+        """Return (offset, dtype, shape) for the record at pos."""
+        magic, length = _MMAP_HEADER.unpack_from(self._buffer, pos)
+        if magic != _MMAP_MAGIC:
+            raise IOError('%s: no NumPyDB_mmap record at position %d' %
+                          (self.dn, pos))
+        start = pos + _MMAP_HEADER.size
+        header = ast.literal_eval(
+            self._buffer[start:start+length].tobytes().decode('ascii'))
+        offset = _mmap_aligned(start + length)
+        dtype = np.lib.format.descr_to_dtype(header['descr'])
+        return offset, dtype, header['shape']
+
+    def _record(self, a):
+        """
+        Return the bytes of the .dat file record holding array a.
+        All records have a length that is a multiple of _MMAP_ALIGN,
+        so the array data in a new record will be aligned too.
+        """
+        a = np.asarray(a, order='C')
+        if a.dtype.hasobject:
+            raise TypeError('NumPyDB_mmap cannot store arrays of Python '
+                            'objects (dtype=%s)' % a.dtype)
+        header = repr({'descr': np.lib.format.dtype_to_descr(a.dtype),
+                       'shape': a.shape}).encode('ascii')
+        size = _MMAP_HEADER.size + len(header)
+        head = _MMAP_HEADER.pack(_MMAP_MAGIC, len(header)) + header + \
+               b'\0'*(_mmap_aligned(size) - size)
+        data = a.tobytes()
+        return head + data + b'\0'*(_mmap_aligned(len(data)) - len(data))
+
+    def locate(self, identifier, bestapprox=None):
+        """
+        As NumPyDB.locate, but an exact identifier match is a
+        dictionary lookup.
+        """
+        identifier = identifier.strip()
+        if identifier in self._index:
+            return self._index[identifier][0], identifier
+        return NumPyDB.locate(self, identifier, bestapprox)
+
+    def load(self, identifier, bestapprox=None):
+        """
+        Load NumPy array with a given identifier. In case the
+        identifier is not found, bestapprox != None means that
+        an approximation is sought. The bestapprox argument is
+        then taken as a function that can be used for computing
+        the distance between two identifiers id1 and id2.
+        The returned array is a read-only np.memmap view of the
+        data file.
+        """
+        pos, id = self.locate(identifier, bestapprox)
+        if pos < 0: return [None, "not found"]
+        offset, dtype, shape = self._index[id]
+        nbytes = dtype.itemsize*int(np.prod(shape))
+        if nbytes == 0:
+            return [np.zeros(shape, dtype), id]
+        a = self._buffer[offset:offset+nbytes].view(dtype).reshape(shape)
+        return [a, id]
+
+_MMAP_MAGIC = b'NPDB'
+_MMAP_HEADER = struct.Struct('<4sI')  # magic, length of header dict
+_MMAP_ALIGN = 64
+
+def _mmap_aligned(n):
+    """Round n up to the nearest multiple of _MMAP_ALIGN."""
+    return -(-n // _MMAP_ALIGN)*_MMAP_ALIGN
+
+
+import zlib, bz2, lzma
+
+# name -> (compress, decompress) functions for NumPyDB_compressed:
+compression_codecs = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bz2':  (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+    'none': (bytes, bytes),
+    }
+
+def register_codec(name, compress, decompress):
+    """
+    Make a codec available for NumPyDB_compressed. compress and
+    decompress are functions from bytes to bytes. The codec name is
+    stored in the data file, so the codec must be registered under
+    the same name when the database is loaded.
+    """
+    compression_codecs[name] = (compress, decompress)
+
+
+class NumPyDB_compressed (NumPyDB):
+    """
+    Store arrays in compressed chunks.
+
+    An array is split along its first axis into chunks of at most
+    chunk_bytes bytes, and each chunk is compressed separately with
+    the codec (a name in compression_codecs: 'zlib', 'bz2', 'lzma',
+    'none', or one added by register_codec). The bytes of each chunk
+    are shuffled (all first bytes of the elements, then all second
+    bytes, etc.) before compression, which makes floating-point data
+    compress much better. The header of each record holds the dtype,
+    shape and the compressed size of each chunk, so load(..., slab=s)
+    decompresses only the chunks covering the rows s of the first
+    axis (e.g., a slab of a 3D field).
+
+    With delta=True, an array with the same dtype and shape as the
+    previously dumped array is stored as the bitwise XOR with the
+    previous array. Slowly varying snapshots then give many zero
+    bytes, which compress well. The stored data are still exact.
+    Every keyframe_interval-th record is stored in full, which
+    limits the number of records that must be decompressed to
+    reconstruct one array.
+
+    >>> import tempfile, os
+    >>> name = os.path.join(tempfile.mkdtemp(), 'compressed')
+    >>> a = np.arange(20.).reshape(10, 2)
+    >>> with NumPyDB_compressed(name, 'store', chunk_bytes=32,
+    ...                         delta=True) as db:   # 2 rows per chunk
+    ...     db.dump(a, 'time=0')
+    ...     db.dump(a + 1, 'time=1')
+    >>> db = NumPyDB_compressed(name, 'load')
+    >>> b, id = db.load('time=1')
+    >>> np.array_equal(b, a + 1)
+    True
+    >>> for slab in (slice(3, 8), slice(None, None, -1), slice(8, 1, -3),
+    ...              slice(5, 5), -1, 4):
+    ...     b, id = db.load('time=0', slab=slab)
+    ...     print(np.array_equal(b, a[slab]))
+    True
+    True
+    True
+    True
+    True
+    True
+    >>> db.load('time=0', slab=slice(None, None, 0))
+    Traceback (most recent call last):
+    ...
+    ValueError: slice step cannot be zero
+    """
+
+    def __init__(self, database_name, mode='store', codec='zlib',
+                 chunk_bytes=2**20, shuffle=True, delta=False,
+                 keyframe_interval=16, **kwargs):
+        NumPyDB.__init__(self, database_name, mode, **kwargs)
+        if codec not in compression_codecs:
+            raise ValueError('codec="%s" is not registered (%s)' %
+                             (codec, ', '.join(compression_codecs)))
+        self.codec = codec
+        self.chunk_bytes = chunk_bytes
+        self.shuffle = shuffle
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self._previous = None  # previous array (in delta mode)
+        self._nchained = 0     # no of delta records since last keyframe
+        if mode == 'load':
+            self._headers = {}  # position -> header
+            # the previous record (in delta mode) is the previous
+            # entry in the map file:
+            self._record_no = dict([(pos, j) for j, (pos, id) in
+                                    enumerate(self.positions)])
+
+    def refresh(self):
+        positions = NumPyDB.refresh(self)
+        n = len(self.positions) - len(positions)
+        for j, (pos, id) in enumerate(positions):
+            self._record_no[pos] = n + j
+        return positions
+
+    def _record(self, a):
+        """Return the header and the compressed chunks of array a."""
+        a = np.asarray(a, order='C')
+        if a.dtype.hasobject:
+            raise TypeError('NumPyDB_compressed cannot store arrays of '
+                            'Python objects (dtype=%s)' % a.dtype)
+        delta = self.delta and self._previous is not None and \
+                self._nchained < self.keyframe_interval - 1 and \
+                self._previous.dtype == a.dtype and \
+                self._previous.shape == a.shape
+        data = a.reshape(-1).view(np.uint8)
+        if delta:
+            data = np.bitwise_xor(data, self._previous.reshape(-1).view(np.uint8))
+            self._nchained += 1
+        else:
+            self._nchained = 0
+        if self.delta:
+            self._previous = a.copy()
+
+        rows = _chunk_rows(a.shape, a.dtype.itemsize, self.chunk_bytes)
+        # (the star import from numpytools hides the built-in max)
+        step = rows*a.dtype.itemsize*int(np.prod(a.shape[1:])) or 1
+        compress = compression_codecs[self.codec][0]
+        chunks = []
+        for start in range(0, data.size, step):
+            chunk = data[start:start + step]
+            if self.shuffle and a.dtype.itemsize > 1:
+                chunk = chunk.reshape(-1, a.dtype.itemsize).T
+            chunks.append(compress(chunk.tobytes()))
+        header = repr({'descr': np.lib.format.dtype_to_descr(a.dtype),
+                       'shape': a.shape, 'codec': self.codec,
+                       'shuffle': self.shuffle, 'delta': delta,
+                       'rows': rows, 'chunks': [len(c) for c in chunks],
+                       }).encode('ascii')
+        return _COMPRESSED_HEADER.pack(_COMPRESSED_MAGIC, len(header)) + \
+               header + b''.join(chunks)
+
+    def _read_header(self, fd, pos):
+        """Return the header dictionary of the record at pos."""
+        if pos not in self._headers:
+            fd.seek(pos)
+            magic, length = _COMPRESSED_HEADER.unpack(
+                fd.read(_COMPRESSED_HEADER.size))
+            if magic != _COMPRESSED_MAGIC:
+                raise IOError('%s: no NumPyDB_compressed record at '
+                              'position %d' % (self.dn, pos))
+            header = ast.literal_eval(fd.read(length).decode('ascii'))
+            header['dtype'] = np.lib.format.descr_to_dtype(header['descr'])
+            # file position of each chunk:
+            start = pos + _COMPRESSED_HEADER.size + length
+            header['offsets'] = start + np.concatenate(
+                ([0], np.cumsum(header['chunks'], dtype=np.int64)))
+            self._headers[pos] = header
+        return self._headers[pos]
+
+    def _read_chunk(self, fd, pos, i):
+        """Return the bytes of chunk no i in the record at pos."""
+        header = self._read_header(fd, pos)
+        fd.seek(header['offsets'][i])
+        decompress = compression_codecs[header['codec']][1]
+        chunk = np.frombuffer(decompress(fd.read(header['chunks'][i])),
+                              np.uint8)
+        itemsize = header['dtype'].itemsize
+        if header['shuffle'] and itemsize > 1:
+            chunk = chunk.reshape(itemsize, -1).T.reshape(-1)
+        if header['delta']:
+            previous = self.positions[self._record_no[pos] - 1][0]
+            chunk = np.bitwise_xor(chunk, self._read_chunk(fd, previous, i))
+        return chunk
+
+    def load(self, identifier, bestapprox=None, slab=None):
+        """
+        Load NumPy array with a given identifier. In case the
+        identifier is not found, bestapprox != None means that
+        an approximation is sought. The bestapprox argument is
+        then taken as a function that can be used for computing
+        the distance between two identifiers id1 and id2.
+        slab is an index or a slice object for the first axis
+        of the array: a[slab] is returned, and only the chunks
+        holding these data are decompressed.
+        """
+        pos, id = self.locate(identifier, bestapprox)
+        if pos < 0: return [None, "not found"]
+        fd = open(self.dn, 'rb')
+        header = self._read_header(fd, pos)
+        dtype, shape, rows = header['dtype'], header['shape'], header['rows']
+        if len(shape) == 0 or slab is None:
+            # whole array:
+            first, last, selected = 0, len(header['chunks']), None
+        else:
+            if isinstance(slab, slice):
+                # (slice.indices raises ValueError for step 0)
+                selected = range(*slab.indices(shape[0]))
+            else:
+                i = range(shape[0])[slab]  # (handles negative ints)
+                selected = range(i, i + 1)
+            if len(selected) == 0:
+                first = last = 0
+            else:
+                # lowest and highest selected row (either order):
+                lo, hi = sorted((selected[0], selected[-1]))
+                first, last = lo // rows, hi // rows + 1
+        data = [self._read_chunk(fd, pos, i) for i in range(first, last)]
+        fd.close()
+        if len(shape) == 0:
+            a = np.concatenate(data).view(dtype).reshape(shape)
+            return [a, id]
+        data = np.concatenate(data) if data else np.zeros(0, np.uint8)
+        a = data.view(dtype).reshape((-1,) + tuple(shape[1:]))
+        if selected is None:
+            return [a, id]
+        if not isinstance(slab, slice):
+            return [a[selected[0] - first*rows], id]
+        if len(selected) == 0:
+            return [a[:0], id]
+        # the selected rows relative to the first decompressed row:
+        return [a[selected[0] - first*rows::selected.step][:len(selected)],
+                id]
+
+_COMPRESSED_MAGIC = b'NPDZ'
+_COMPRESSED_HEADER = struct.Struct('<4sI')  # magic, length of header dict
+
+def _chunk_rows(shape, itemsize, chunk_bytes):
+    """Return the number of rows (along the first axis) in a chunk."""
+    row_nbytes = itemsize
+    for n in shape[1:]:
+        row_nbytes *= n
+    if row_nbytes == 0:
+        return 1
+    return chunk_bytes // row_nbytes or 1
+
+
 import shelve
 
 class NumPyDB_shelve:
     """Implement the database via shelving."""
 
-    def __init__(self, database_name, mode='store'):
+    def __init__(self, database_name, mode='store', numeric_key=None,
+                 batch_size=64):
         self.filename = database_name # no suffix, only one file
+        self.mode = mode
+        self.batch_size = batch_size  # sync interval when the shelf is open
+        self._shelf = None
+        self._numeric = None
         if mode == 'load':
             # since the keys() function in a shelf object
             # is slow, we store the keys:
             fd = shelve.open(self.filename)
             self.keys = list(fd.keys())
             fd.close()
+            self._all_keys = set(self.keys)
+            if numeric_key:
+                # (see NumPyDB.__init__)
+                self._numeric = _NumericIndex(self.keys, self.keys,
+                                              numeric_key)
+
+    def refresh(self):
+        """
+        Read the keys again (to see data dumped after the database
+        was opened). Note that the underlying dbm databases do not
+        support a reader and a writer in different processes, so
+        use one of the NumPyDB classes for concurrent access.
+        """
+        fd = shelve.open(self.filename)
+        keys = [id for id in fd.keys() if id not in self._all_keys]
+        fd.close()
+        self.keys.extend(keys)
+        self._all_keys.update(keys)
+        if self._numeric is not None:
+            self._numeric.add(keys, keys)
+        return keys
+
+    def open(self):
+        """Keep the shelf open for a sequence of dumps."""
+        if self._shelf is None and self.mode in ('store', 'append'):
+            self._shelf = shelve.open(self.filename)
+            self._nunsynced = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def flush(self):
+        if self._shelf is not None:
+            self._shelf.sync()
+            self._nunsynced = 0
+
+    def close(self):
+        if self._shelf is not None:
+            self._shelf.close()
+            self._shelf = None
 
     def dump(self, a, identifier):
         """Dump NumPy array a with identifier."""
         identifier = identifier.strip()
-        fd = shelve.open(self.filename)
-        fd[identifier] = a
-        fd.close()
+        if self._shelf is None:
+            fd = shelve.open(self.filename)
+            fd[identifier] = a
+            fd.close()
+        else:
+            self._shelf[identifier] = a
+            self._nunsynced += 1
+            if self._nunsynced >= self.batch_size:
+                self.flush()
 
     def locate(self, identifier, bestapprox=None):
         """Return identifier key in shelf."""
         selected_id = None
         identifier = identifier.strip()
-        if identifier in self.keys:
+        if self._numeric is not None:
+            selected_id = self._numeric.exact(identifier)
+            if selected_id is None and bestapprox:
+                selected_id = self._numeric.nearest(identifier)
+        elif identifier in self.keys:
             selected_id = identifier
         else:
             if bestapprox:
@@ -226,6 +891,17 @@ class NumPyDB_shelve:
                         min_dist = d
         return selected_id
 
+    def locate_range(self, lower, upper):
+        """
+        Return a list of the identifier keys whose numeric value
+        lies in [lower, upper], sorted with respect to this value.
+        Requires the numeric_key argument in the constructor.
+        """
+        if self._numeric is None:
+            raise ValueError('locate_range requires a database opened '
+                             'with the numeric_key argument')
+        return self._numeric.range(lower, upper)
+
     def load(self, identifier, bestapprox=None):
         """
         Load NumPy array with a given identifier. In case the
@@ -241,9 +917,318 @@ class NumPyDB_shelve:
         fd.close()
         return a, id
 
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+class NumPyDB_async:
+    """
+    Dump arrays to a NumPyDB database (any of the classes above)
+    in a background thread, so the caller (e.g., the time loop in
+    a solver) does not wait for serialization and disk writes::
+
+        db = NumPyDB_async(NumPyDB_cPickle('mydata', 'store'))
+        for n in range(nsteps):
+            # compute u
+            db.dump(u, 'time=%g' % t)
+        db.close()   # wait for all dumps to complete
+
+    The copy argument determines how the array is protected from
+    being changed by the caller before it is written:
+
+      - 'copy': dump stores a copy of the array (default).
+      - 'readonly': no copy, the array is marked read-only until it
+        is written (until all its dumps are written, if it is dumped
+        several times), so in-place updates raise ValueError (the
+        caller must then work on a new array, e.g., swap two arrays).
+      - 'none': no protection, the caller promises not to change
+        the array.
+
+    At most queue_size arrays wait to be written. dump blocks
+    (backpressure) when the queue is full, or raises queue.Full if
+    the timeout argument is given and passes. stats() reports the
+    queue depth and the write throughput.
+
+    An exception in the background thread stops the writing: the
+    arrays still in the queue are not written, and the exception is
+    raised by every later call to dump, flush and close:
+
+    >>> import tempfile, os
+    >>> name = os.path.join(tempfile.mkdtemp(), 'async')
+    >>> db = NumPyDB_async(NumPyDB_mmap(name, 'store'), copy='readonly')
+    >>> a = np.zeros(3)
+    >>> db.dump(a, 'time=0'); db.dump(a, 'time=1')
+    >>> db.flush()
+    >>> a.flags.writeable
+    True
+    >>> db.dump(np.array([1, 'a'], dtype=object), 'time=2')
+    >>> db.dump(np.ones(3), 'time=3')
+    >>> db.flush()
+    Traceback (most recent call last):
+    ...
+    TypeError: NumPyDB_mmap cannot store arrays of Python objects (dtype=object)
+    >>> db.dump(np.ones(3), 'time=4')
+    Traceback (most recent call last):
+    ...
+    TypeError: NumPyDB_mmap cannot store arrays of Python objects (dtype=object)
+    >>> db.stats()['records']
+    2
+    >>> db.close()
+    Traceback (most recent call last):
+    ...
+    TypeError: NumPyDB_mmap cannot store arrays of Python objects (dtype=object)
+    >>> [id for pos, id in NumPyDB_mmap(name, 'load').positions]
+    ['time=0', 'time=1']
+    """
+
+    def __init__(self, db, queue_size=8, copy='copy'):
+        if copy not in ('copy', 'readonly', 'none'):
+            raise ValueError('copy="%s" is illegal' % copy)
+        self.db = db
+        self.copy = copy
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        # id(array) -> [array, no of queued dumps, writeable before],
+        # for arrays made read-only in 'readonly' mode:
+        self._readonly = {}
+        self._readonly_lock = threading.Lock()
+        self._stats = {'records': 0, 'bytes': 0, 'write_time': 0.0,
+                       'blocked_time': 0.0, 'max_queue_depth': 0}
+        self.db.open()
+        self._thread = threading.Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _writer(self):
+        """Dump the arrays in the queue (run in the background thread)."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                a, identifier = item
+                try:
+                    if self._error is None:  # (skip after an error)
+                        t0 = time.time()
+                        self.db.dump(a, identifier)
+                        self._stats['write_time'] += time.time() - t0
+                        self._stats['records'] += 1
+                        self._stats['bytes'] += a.nbytes
+                finally:
+                    self._release(a)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _protect(self, a):
+        """Make a read-only until _release(a) (in 'readonly' mode)."""
+        if self.copy == 'readonly':
+            with self._readonly_lock:
+                entry = self._readonly.get(id(a))
+                if entry is None:
+                    entry = [a, 0, a.flags.writeable]
+                    self._readonly[id(a)] = entry
+                    a.flags.writeable = False
+                entry[1] += 1
+
+    def _release(self, a):
+        """Undo one _protect(a); a is writeable after the last one."""
+        if self.copy == 'readonly':
+            with self._readonly_lock:
+                entry = self._readonly[id(a)]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._readonly[id(a)]
+                    if entry[2]:
+                        a.flags.writeable = True
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def dump(self, a, identifier, timeout=None):
+        """Queue NumPy array a with identifier for dumping."""
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise ValueError('dump in a closed NumPyDB_async database')
+        if self.copy == 'copy':
+            a = np.array(a, copy=True)
+        else:
+            a = np.asarray(a)
+        self._protect(a)
+        t0 = time.time()
+        try:
+            self._queue.put((a, identifier), timeout=timeout)
+        except queue.Full:
+            self._release(a)
+            raise
+        self._stats['blocked_time'] += time.time() - t0
+        depth = self._queue.qsize()
+        if depth > self._stats['max_queue_depth']:
+            self._stats['max_queue_depth'] = depth
+
+    @property
+    def queue_depth(self):
+        """Number of arrays waiting to be written."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Return a dictionary with the number of records and bytes
+        written, the time spent on writing in the background thread,
+        the write throughput (bytes per second of write time), the
+        time the caller was blocked by a full queue, and the current
+        and maximum queue depth.
+        """
+        s = self._stats.copy()
+        s['queue_depth'] = self.queue_depth
+        s['throughput'] = s['bytes']/s['write_time'] \
+                          if s['write_time'] > 0 else 0.0
+        return s
+
+    def flush(self):
+        """Wait until all queued arrays are written to file."""
+        self._queue.join()
+        self.db.flush()
+        self._raise_error()
+
+    def close(self):
+        """Write all queued arrays, stop the thread and close the files."""
+        if self._thread.is_alive():
+            self._queue.join()
+            self._queue.put(None)
+            self._thread.join()
+            self.db.close()
+        self._raise_error()
+
+
 # np.load/dump
 # joblib.load/dump
 
+
+class _NumericIndex:
+    """
+    Sorted array of numbers extracted from the identifiers in a
+    database, for best-approximation and range lookups by binary
+    search. items[i] is returned for identifiers[i] (a
+    (position, identifier) tuple in NumPyDB, the identifier itself
+    in NumPyDB_shelve).
+    """
+
+    def __init__(self, identifiers, items, key=True):
+        if key is True:
+            key = numeric_identifier
+        self.key = key
+        self.ids = {}  # identifier -> item, for exact lookup
+        self.values = np.zeros(0)
+        self.items = []
+        self.add(identifiers, items)
+
+    def add(self, identifiers, items):
+        """Add new identifiers (and corresponding items) to the index."""
+        for id, item in zip(identifiers, items):
+            if id not in self.ids:  # first record wins, as in locate
+                self.ids[id] = item
+        values = np.array([self.key(id) for id in identifiers], dtype=float)
+        if np.all(np.diff(values) >= 0) and \
+           (len(self.values) == 0 or len(values) == 0 or
+            values[0] >= self.values[-1]):
+            # new items come in sorted order (typically increasing
+            # time values), just append:
+            self.values = np.concatenate((self.values, values))
+            self.items.extend(items)
+            return
+        values = np.concatenate((self.values, values))
+        items = self.items + list(items)
+        order = np.argsort(values, kind='stable')
+        self.values = values[order]
+        self.items = [items[i] for i in order]
+
+    def exact(self, identifier):
+        return self.ids.get(identifier)
+
+    def nearest(self, identifier):
+        """Return the item with number closest to that in identifier."""
+        if not self.items:
+            return None
+        try:
+            value = self.key(identifier)
+        except ValueError:
+            return None
+        i = np.searchsorted(self.values, value)
+        if i == len(self.values) or \
+           (i > 0 and value - self.values[i-1] < self.values[i] - value):
+            i -= 1
+        return self.items[i]
+
+    def range(self, lower, upper):
+        """Return the items with number in [lower, upper]."""
+        start = np.searchsorted(self.values, lower, side='left')
+        stop = np.searchsorted(self.values, upper, side='right')
+        return self.items[start:stop]
+
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # not available on Windows, no locking
+
+def _lock(f, blocking=True):
+    """
+    Set an exclusive lock on the open file f (released when f is
+    closed). If blocking is false, IOError is raised if another
+    process holds the lock.
+    """
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.flock(f.fileno(), flags)
+
+
+def _remove_incomplete_line(f):
+    """
+    Truncate the open (and locked) map file f after its last
+    newline, i.e., remove a line left incomplete by a writer that
+    crashed, so new lines are not appended to it.
+    """
+    end = os.fstat(f.fileno()).st_size
+    r = open(f.name, 'rb')
+    try:
+        while end > 0:
+            start = end - 4096 if end > 4096 else 0
+            r.seek(start)
+            i = r.read(end - start).rfind(b'\n')
+            if i >= 0:
+                end = start + i + 1
+                break
+            end = start
+    finally:
+        r.close()
+    if end < os.fstat(f.fileno()).st_size:
+        f.truncate(end)
+
+
+def numeric_identifier(identifier):
+    """
+    Return the last number in an identifier string as a float,
+    e.g., 1.5 for 'time=1.5' or 'u at t=1.5'. This is the default
+    numeric_key function in the NumPyDB classes.
+    """
+    numbers = _number.findall(identifier)
+    if not numbers:
+        raise ValueError('no number in identifier "%s"' % identifier)
+    return float(numbers[-1])
+
+_number = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
 def float_dist(id1, id2):
     """
     Compute distance between two identities for NumPyDB.
@@ -267,6 +1252,10 @@ def _test_dist(id1, id2):
     d = abs(float(t1) - float(t2))
     return d
 
+def _doctest():
+    import doctest
+    return doctest.testmod(sys.modules[__name__])
+
 def main(n, length, method, name):
     out = "dumping/loading %d %d-arrays data with the %s method took" \
           % (n,length,method)
@@ -278,6 +1267,10 @@ def main(n, length, method, name):
         dataout = NumPyDB_shelve(name, 'store')
     elif method == "text":
         dataout = NumPyDB_text(name, 'store')
+    elif method == "mmap":
+        dataout = NumPyDB_mmap(name, 'store')
+    elif method == "compressed":
+        dataout = NumPyDB_compressed(name, 'store')
     else:
         raise ValueError("illegal method name='%s'" % method)
 
@@ -298,6 +1291,10 @@ def main(n, length, method, name):
         datain = NumPyDB_shelve(name, 'load')
     elif method == "text":
         datain = NumPyDB_text(name, 'load')
+    elif method == "mmap":
+        datain = NumPyDB_mmap(name, 'load')
+    elif method == "compressed":
+        datain = NumPyDB_compressed(name, 'load')
     else:
         raise ValueError("illegal method name='%s'" % method)
 
@@ -324,12 +1321,16 @@ def main(n, length, method, name):
             os.remove(filename)
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['doctest']:
+        _doctest()
+        sys.exit(0)
     try:     n = int(sys.argv[1])
     except:  n = 12
     try:     length = int(sys.argv[2])
     except:  length = 10
     try:     methods = [sys.argv[3]]
-    except:  methods = ['pickle','cPickle','shelve','text']
+    except:  methods = ['pickle','cPickle','shelve','text','mmap',
+                  'compressed']
     print('NumPy array type:', basic_NumPy)
     for method in methods:
         main(n, length, method, "tmpdata_" + method)
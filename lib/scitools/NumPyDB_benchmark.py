@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the storage backends in the NumPyDB module.
+
+The benchmark function dumps a number of arrays to a database with
+every backend and measures the time of various access patterns:
+
+  - dump: sequential dump of all records (in a with statement)
+  - load: load of all records in random order
+  - nearest: load with an identifier that does not match exactly
+    (bestapprox, using the numeric identifier index)
+  - range: locate all records in the middle half of the time
+    interval (locate_range) and load them
+
+for all combinations of array sizes, record counts and dtypes.
+The results are a list of dictionaries that write_results turns
+into a tab-separated table (one line per measurement, suitable for
+comparing storage throughput between releases), and
+efficiency_table turns into an EfficiencyTable report::
+
+    from scitools.NumPyDB_benchmark import *
+    results = benchmark(sizes=[1000, 100000], nrecords=[100])
+    f = open('numpydb_bench.dat', 'w')
+    write_results(results, f)
+    f.close()
+    print(efficiency_table(results, 'load'))
+
+A small run:
+
+>>> import io
+>>> results = benchmark(['mmap', 'pickle'], sizes=[10], nrecords=[8])
+>>> [(r['backend'], r['pattern']) for r in results[:4]]
+[('mmap', 'dump'), ('mmap', 'load'), ('mmap', 'nearest'), ('mmap', 'range')]
+>>> f = io.StringIO()
+>>> write_results(results, f)
+>>> lines = f.getvalue().splitlines()
+>>> len(lines), lines[0].split()
+(9, ['backend', 'pattern', 'size', 'records', 'dtype', 'seconds', 'MB_per_s'])
+>>> lines[-1].split()[:5]
+['pickle', 'range', '10', '8', 'float64']
+
+From the command line::
+
+    python NumPyDB_benchmark.py --sizes 1000,100000 --records 100 \\
+           --dtypes float64,float32 --output numpydb_bench.dat
+"""
+
+import os, sys, time, random, shutil, tempfile
+import numpy as np
+from scitools.NumPyDB import NumPyDB_text, NumPyDB_pickle, \
+     NumPyDB_cPickle, NumPyDB_mmap, NumPyDB_compressed, NumPyDB_shelve
+from scitools.EfficiencyTable import EfficiencyTable
+
+__all__ = ['backends', 'patterns', 'benchmark', 'write_results',
+           'efficiency_table']
+
+# name -> (class, keyword arguments to the constructor):
+backends = {
+    'text':       (NumPyDB_text, {}),
+    'pickle':     (NumPyDB_pickle, {}),
+    'cPickle':    (NumPyDB_cPickle, {}),
+    'mmap':       (NumPyDB_mmap, {}),
+    'compressed': (NumPyDB_compressed, {}),
+    'zlib-delta': (NumPyDB_compressed, {'delta': True}),
+    'shelve':     (NumPyDB_shelve, {}),
+    }
+
+patterns = ['dump', 'load', 'nearest', 'range']
+
+_columns = ['backend', 'pattern', 'size', 'records', 'dtype',
+            'seconds', 'MB_per_s']
+
+
+def _snapshots(size, nrecords, dtype):
+    """Yield (array, identifier) for nrecords slowly varying snapshots."""
+    x = np.linspace(0, 1, size)
+    for i in range(nrecords):
+        t = 0.01*i
+        yield (np.sin(2*np.pi*(x - t))*1000).astype(dtype), 'time=%e' % t
+
+
+def _touch(a):
+    """Access all data in a (memory-mapped arrays are loaded lazily)."""
+    if a is not None and np.size(a) > 0:
+        np.max(a)
+
+
+def _run(cls, kwargs, name, size, nrecords, dtype, patterns):
+    """Run the patterns for one backend, return {pattern: seconds}."""
+    times = {}
+    t0 = time.perf_counter()
+    with cls(name, 'store', **kwargs) as db:
+        for a, identifier in _snapshots(size, nrecords, dtype):
+            db.dump(a, identifier)
+    times['dump'] = time.perf_counter() - t0
+
+    kwargs = dict([(k, v) for k, v in kwargs.items() if k != 'delta'])
+    db = cls(name, 'load', numeric_key=True, **kwargs)
+    t = [0.01*i for i in range(nrecords)]
+    if 'load' in patterns:
+        order = list(range(nrecords))
+        random.Random(1).shuffle(order)
+        t0 = time.perf_counter()
+        for i in order:
+            _touch(db.load('time=%e' % t[i])[0])
+        times['load'] = time.perf_counter() - t0
+    if 'nearest' in patterns:
+        t0 = time.perf_counter()
+        for i in range(nrecords):
+            _touch(db.load('time=%g' % (t[i] + 0.003), bestapprox=True)[0])
+        times['nearest'] = time.perf_counter() - t0
+    if 'range' in patterns:
+        t0 = time.perf_counter()
+        found = db.locate_range(t[-1]/4., 3*t[-1]/4.)
+        for item in found:
+            identifier = item if isinstance(item, str) else item[1]
+            _touch(db.load(identifier)[0])
+        times['range'] = time.perf_counter() - t0
+        times['range_records'] = len(found)
+    return times
+
+
+def benchmark(backend_names=None, sizes=(1000, 100000), nrecords=(100,),
+              dtypes=('float64',), patterns=patterns, directory=None,
+              verbose=False):
+    """
+    Run the benchmarks for all combinations of backend names
+    (keys in the backends dictionary, default all), array sizes,
+    numbers of records, dtypes and access patterns. The databases
+    are made in a temporary directory in directory (default: the
+    system's temporary directory) and removed afterwards.
+    Return a list of dictionaries with keys backend, pattern, size,
+    records, dtype, seconds and MB_per_s.
+    """
+    if backend_names is None:
+        backend_names = sorted(backends)
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='NumPyDB_benchmark_', dir=directory)
+    try:
+        for name in backend_names:
+            cls, kwargs = backends[name]
+            for size in sizes:
+                for n in nrecords:
+                    for dtype in dtypes:
+                        path = os.path.join(tmpdir, '%s_%d_%d_%s' %
+                                            (name, size, n, dtype))
+                        times = _run(cls, kwargs, path, size, n, dtype,
+                                     patterns)
+                        nbytes = np.dtype(dtype).itemsize*size
+                        for pattern in patterns:
+                            nloaded = times.get('range_records', n) \
+                                      if pattern == 'range' else n
+                            seconds = times[pattern]
+                            results.append(dict(
+                                backend=name, pattern=pattern, size=size,
+                                records=n, dtype=dtype, seconds=seconds,
+                                MB_per_s=nbytes*nloaded/1E+6/seconds
+                                if seconds > 0 else float('inf')))
+                            if verbose:
+                                print('%(backend)-10s %(pattern)-8s '
+                                      'size=%(size)d records=%(records)d '
+                                      '%(dtype)s: %(seconds).3g s' %
+                                      results[-1])
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def write_results(results, fileobj):
+    """
+    Write results from benchmark as a tab-separated table with a
+    header line to the file object fileobj.
+    """
+    fileobj.write('\t'.join(_columns) + '\n')
+    for r in results:
+        fileobj.write('%s\t%s\t%d\t%d\t%s\t%.6g\t%.6g\n' %
+                      tuple([r[c] for c in _columns]))
+
+
+def efficiency_table(results, pattern):
+    """
+    Return an EfficiencyTable comparing the backends for an access
+    pattern. There is one entry per backend, size, number of records
+    and dtype.
+    """
+    e = EfficiencyTable('NumPyDB backends, access pattern "%s"' % pattern)
+    for r in results:
+        if r['pattern'] == pattern:
+            e.add('%(backend)s, size=%(size)d, records=%(records)d, '
+                  '%(dtype)s' % r, r['seconds'])
+    return e
+
+
+def _main():
+    import getopt
+    options, args = getopt.getopt(
+        sys.argv[1:], '',
+        ['backends=', 'sizes=', 'records=', 'dtypes=', 'patterns=',
+         'output='])
+    kwargs = {}
+    output = None
+    for option, value in options:
+        if option == '--backends':
+            kwargs['backend_names'] = value.split(',')
+        elif option == '--sizes':
+            kwargs['sizes'] = [int(v) for v in value.split(',')]
+        elif option == '--records':
+            kwargs['nrecords'] = [int(v) for v in value.split(',')]
+        elif option == '--dtypes':
+            kwargs['dtypes'] = value.split(',')
+        elif option == '--patterns':
+            kwargs['patterns'] = value.split(',')
+        elif option == '--output':
+            output = value
+    results = benchmark(verbose=True, **kwargs)
+    if output is not None:
+        f = open(output, 'w')
+        write_results(results, f)
+        f.close()
+    for pattern in kwargs.get('patterns', patterns):
+        print(efficiency_table(results, pattern))
+
+if __name__ == '__main__':
+    _main()
@@ -32,6 +32,533 @@ exec(s)
 # self.__call__ to be this lambda function.
 
 import re
+import os
+import sys
+import ast
+import copy
+import ctypes
+import hashlib
+import functools
+import importlib
+import importlib.util
+import subprocess
+import numpy as _np
+try:
+    from scitools.globaldata import OPTIMIZATION
+except ImportError:
+    OPTIMIZATION = 'off'
+
+# Max no of compiled formulas in the cache used by _lambda_code:
+CACHE_SIZE = 512
+# Directory with shared libraries for StringFunction(..., compile='c')
+# and modules for compile='numba', and the C compiler command (the
+# library file name is added):
+C_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME',
+                   os.path.join(os.path.expanduser('~'), '.cache')),
+    'scitools', 'StringFunction')
+C_COMPILER = os.environ.get('CC', 'cc') + ' -O3 -fno-math-errno -shared -fPIC'
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _lambda_code(expression, variables, prm_names, function_in_module=None):
+    """
+    Return the code object and the source of a "factory" function
+    for a StringFunction: the factory takes the parameter values
+    (and the module object if function_in_module is a (module,
+    function) pair) as arguments and returns a lambda function of
+    the independent variables. The parameters are free variables
+    in the lambda function, i.e., they are stored in the cells of
+    its __closure__ and can be changed without building a new
+    function. The result is cached, so StringFunction objects
+    with the same formula, independent variables and parameter
+    names share the compiled code (see cache_info).
+    """
+    args = ', '.join(variables)
+    factory_args = list(prm_names)
+
+    s = 'lambda ' + args
+    if function_in_module is None:
+        # insert string expression as body in the lambda function:
+        s += ': ' + expression
+    else:
+        # let lambda call a function in a file (module):
+        factory_args.append('module')
+        kwargs = ', '.join(['%s=%s' % (k, k) for k in prm_names])
+        s += ': module.%s(%s%s)' % \
+             (function_in_module[1], args, ', ' + kwargs if kwargs else '')
+    source = 'lambda %s: (%s)' % (', '.join(factory_args), s)
+    return compile(source, '<StringFunction>', 'eval'), s
+
+
+# Translation of math functions and operators to NumPy ufuncs in
+# vectorized formulas (see _vectorized_code):
+_ufuncs = {'acos': 'arccos', 'asin': 'arcsin', 'atan': 'arctan',
+           'atan2': 'arctan2', 'acosh': 'arccosh', 'asinh': 'arcsinh',
+           'atanh': 'arctanh', 'pow': 'power', 'abs': 'absolute',
+           'fabs': 'fabs', 'ceil': 'ceil', 'floor': 'floor',
+           'exp': 'exp', 'expm1': 'expm1', 'log': 'log', 'log10': 'log10',
+           'log2': 'log2', 'log1p': 'log1p', 'sqrt': 'sqrt', 'hypot': 'hypot',
+           'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'sinh': 'sinh',
+           'cosh': 'cosh', 'tanh': 'tanh', 'arcsin': 'arcsin',
+           'arccos': 'arccos', 'arctan': 'arctan', 'arctan2': 'arctan2',
+           'arcsinh': 'arcsinh', 'arccosh': 'arccosh',
+           'arctanh': 'arctanh', 'absolute': 'absolute',
+           'power': 'power', 'sign': 'sign', 'square': 'square',
+           'minimum': 'minimum', 'maximum': 'maximum'}
+_binop_ufuncs = {ast.Add: 'add', ast.Sub: 'subtract', ast.Mult: 'multiply',
+                 ast.Div: 'true_divide', ast.FloorDiv: 'floor_divide',
+                 ast.Mod: 'remainder', ast.Pow: 'power'}
+_unaryop_ufuncs = {ast.USub: 'negative', ast.Not: 'logical_not'}
+_compare_ufuncs = {ast.Lt: 'less', ast.LtE: 'less_equal',
+                   ast.Gt: 'greater', ast.GtE: 'greater_equal',
+                   ast.Eq: 'equal', ast.NotEq: 'not_equal'}
+_constants = {'pi': '_np.pi', 'e': '_np.e'}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _ufunc(ufunc, out, *args):
+    """
+    Return ufunc(*args), computed in place in the array out (a
+    temporary array that is not used afterwards) if out has the
+    shape and type of the result.
+    """
+    if type(out) is _np.ndarray:
+        try:
+            return ufunc(*args, out=out, casting='equiv')
+        except (TypeError, ValueError):
+            pass  # other shape or type of the result
+    return ufunc(*args)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _vectorized_code(expression, variables, prm_names):
+    """
+    Translate expression to a function of the independent variables
+    for NumPy array arguments. The math functions and operators
+    become NumPy ufunc calls, one per statement, where common
+    subexpressions are computed only once and ufuncs store their
+    result in a temporary array that is not used afterwards (out=
+    argument, through _ufunc). Return the code object and source
+    of a factory taking the parameter values as arguments and
+    returning the function (the parameters are free variables in
+    the function, as in _lambda_code), and the source of the
+    function. Return None if the expression contains constructions
+    (or names) that are not supported.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    names = set(variables) | set(prm_names)
+    statements = []  # (temporary, ufunc, operands)
+    memo = {}        # ast.dump(node) -> operand
+
+    def constant(node):
+        # is node an expression with number literals only?
+        for n in ast.walk(node):
+            if isinstance(n, ast.Constant):
+                if isinstance(n.value, bool) or \
+                   not isinstance(n.value, (int, float, complex)):
+                    return False
+            elif not isinstance(n, (ast.BinOp, ast.UnaryOp, ast.operator,
+                                    ast.unaryop)):
+                return False
+        return True
+
+    def visit(node):
+        key = ast.dump(node)
+        if key in memo:
+            return memo[key]
+        if constant(node):
+            r = '(%s)' % ast.unparse(node)
+        elif isinstance(node, ast.Name):
+            if node.id in names:
+                r = node.id
+            elif node.id in _constants:
+                r = _constants[node.id]
+            else:
+                raise _Unsupported(node.id)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+            r = visit(node.operand)
+        else:
+            if isinstance(node, ast.BinOp) and type(node.op) in _binop_ufuncs:
+                if isinstance(node.op, ast.Pow) and \
+                   isinstance(node.right, ast.Constant) and \
+                   node.right.value == 2:
+                    ufunc, args = 'square', [node.left]
+                else:
+                    ufunc = _binop_ufuncs[type(node.op)]
+                    args = [node.left, node.right]
+            elif isinstance(node, ast.UnaryOp) and \
+                 type(node.op) in _unaryop_ufuncs:
+                ufunc, args = _unaryop_ufuncs[type(node.op)], [node.operand]
+            elif isinstance(node, ast.Compare) and len(node.ops) == 1 and \
+                 type(node.ops[0]) in _compare_ufuncs:
+                ufunc = _compare_ufuncs[type(node.ops[0])]
+                args = [node.left, node.comparators[0]]
+            elif isinstance(node, ast.Call) and \
+                 isinstance(node.func, ast.Name) and \
+                 node.func.id not in names and node.func.id in _ufuncs and \
+                 not node.keywords and \
+                 not [a for a in node.args if isinstance(a, ast.Starred)]:
+                ufunc, args = _ufuncs[node.func.id], node.args
+            else:
+                raise _Unsupported(ast.unparse(node))
+            operands = [visit(a) for a in args]
+            r = '_t%d' % len(statements)
+            statements.append((r, ufunc, operands))
+        memo[key] = r
+        return r
+
+    try:
+        result = visit(tree)
+    except _Unsupported:
+        return None
+
+    # a temporary can hold the result of the statement where it is
+    # used for the last time:
+    last_use = {}
+    for i, (target, ufunc, operands) in enumerate(statements):
+        for operand in operands:
+            last_use[operand] = i
+    last_use[result] = len(statements)
+
+    lines = ['def _f(%s):' % ', '.join(variables)]
+    for i, (target, ufunc, operands) in enumerate(statements):
+        free = [op for op in operands
+                if op.startswith('_t') and last_use[op] == i]
+        if free:
+            lines.append('    %s = _ufunc(_np.%s, %s, %s)' %
+                         (target, ufunc, free[0], ', '.join(operands)))
+        else:
+            lines.append('    %s = _np.%s(%s)' %
+                         (target, ufunc, ', '.join(operands)))
+    lines.append('    return %s' % result)
+    s = '\n'.join(lines)
+    source = 'def _factory(%s):\n%s\n    return _f\n' % \
+             (', '.join(prm_names),
+              '\n'.join(['    ' + line for line in lines]))
+    return compile(source, '<StringFunction>', 'exec'), s
+
+
+# Translation of Python math functions and operators to C
+# (see _c_expression):
+_c_functions = dict([(name, name) for name in math_functions
+                     if name != 'pi'])
+_c_functions['abs'] = 'fabs'
+_c_operators = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+                ast.USub: '-', ast.UAdd: '+', ast.Lt: '<', ast.LtE: '<=',
+                ast.Gt: '>', ast.GtE: '>=', ast.Eq: '==', ast.NotEq: '!='}
+
+
+def _c_expression(expression, names):
+    """
+    Translate expression to C, where names are the independent
+    variables and parameters. All numbers become double literals
+    (1/2 is 0.5 as in Python), a**b becomes pow(a, b), or repeated
+    multiplication (sf_powi) if b is a small integer, and pi is
+    M_PI. Return None for expressions that cannot be translated.
+    """
+    def c(node):
+        if isinstance(node, ast.Constant) and \
+           type(node.value) in (int, float):
+            return repr(float(node.value))
+        elif isinstance(node, ast.Name):
+            if node.id in names:
+                return node.id
+            elif node.id == 'pi':
+                return 'M_PI'
+        elif isinstance(node, ast.BinOp):
+            if isinstance(node.op, ast.Pow):
+                n = _integer_exponent(node.right)
+                if n is None:
+                    return 'pow(%s, %s)' % (c(node.left), c(node.right))
+                elif n < 0:
+                    return '(1.0/sf_powi(%s, %d))' % (c(node.left), -n)
+                return 'sf_powi(%s, %d)' % (c(node.left), n)
+            elif type(node.op) in _c_operators:
+                return '(%s %s %s)' % (c(node.left),
+                                       _c_operators[type(node.op)],
+                                       c(node.right))
+        elif isinstance(node, ast.UnaryOp) and \
+             type(node.op) in _c_operators:
+            return '(%s%s)' % (_c_operators[type(node.op)], c(node.operand))
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1 and \
+             type(node.ops[0]) in _c_operators:
+            return '(%s %s %s)' % (c(node.left),
+                                   _c_operators[type(node.ops[0])],
+                                   c(node.comparators[0]))
+        elif isinstance(node, ast.Call) and \
+             isinstance(node.func, ast.Name) and \
+             node.func.id not in names and node.func.id in _c_functions and \
+             not node.keywords and \
+             not [a for a in node.args if isinstance(a, ast.Starred)]:
+            return '%s(%s)' % (_c_functions[node.func.id],
+                               ', '.join([c(a) for a in node.args]))
+        raise _Unsupported(ast.dump(node))
+
+    try:
+        return c(ast.parse(expression.strip(), mode='eval').body)
+    except (SyntaxError, _Unsupported):
+        return None
+
+
+def _integer_exponent(node):
+    """
+    Return the exponent in node (the right operand of **) if it is
+    an integer constant of magnitude at most 64, otherwise None.
+    """
+    sign = 1
+    if isinstance(node, ast.UnaryOp) and \
+       isinstance(node.op, (ast.USub, ast.UAdd)):
+        sign = -1 if isinstance(node.op, ast.USub) else 1
+        node = node.operand
+    if isinstance(node, ast.Constant) and \
+       type(node.value) in (int, float) and \
+       float(node.value).is_integer() and abs(node.value) <= 64:
+        return sign*int(node.value)
+    return None
+
+
+def _is_comparison(expression):
+    """Return True if expression is a comparison (boolean values)."""
+    try:
+        return isinstance(ast.parse(expression.strip(), mode='eval').body,
+                          ast.Compare)
+    except SyntaxError:
+        return False
+
+
+def _c_source(expression, variables, prm_names):
+    """
+    Return C code with a function sf_eval(n, r, prm, x, y, ...)
+    storing the expression at x[i], y[i], ... in r[i], i=0,...,n-1,
+    with the parameter values in the array prm, or None if the
+    expression cannot be translated to C.
+    """
+    c_expression = _c_expression(expression, set(variables) |
+                                 set(prm_names))
+    if c_expression is None:
+        return None
+    args = ', '.join(['double %s' % name for name in
+                      tuple(variables) + tuple(prm_names)])
+    arrays = ''.join([', const double *sf_%d_' % i
+                      for i in range(len(variables))])
+    values = ['sf_%d_[sf_i_]' % i for i in range(len(variables))] + \
+             ['sf_prm_[%d]' % i for i in range(len(prm_names))]
+    return """\
+#include <math.h>
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+static inline double sf_powi(double x, int n)
+{
+  double r = 1.0;
+  for (; n > 0; n >>= 1, x *= x)
+    if (n & 1)
+      r *= x;
+  return r;
+}
+
+static double sf_func(%s)
+{
+  return %s;
+}
+
+void sf_eval(long sf_n_, double *sf_r_, const double *sf_prm_%s)
+{
+  long sf_i_;
+  for (sf_i_ = 0; sf_i_ < sf_n_; sf_i_++)
+    sf_r_[sf_i_] = sf_func(%s);
+}
+""" % (args, c_expression, arrays, ', '.join(values))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _c_library(expression, variables, prm_names):
+    """
+    Return the sf_eval function (see _c_source) for expression as a
+    ctypes function. The shared library is compiled with
+    C_COMPILER and stored in C_CACHE_DIR under a name with the hash
+    of the code, so it is compiled only once for each formula.
+    Return None if the expression cannot be translated to C or
+    compiled.
+    """
+    code = _c_source(expression, variables, prm_names)
+    if code is None:
+        return None
+    key = hashlib.sha1((C_COMPILER + '\n' + code).encode()).hexdigest()
+    libname = os.path.join(C_CACHE_DIR, 'sf_%s.so' % key)
+    if not os.path.isfile(libname):
+        try:
+            if not os.path.isdir(C_CACHE_DIR):
+                os.makedirs(C_CACHE_DIR)
+            # compile to a file of our own and rename (other processes
+            # may compile the same formula):
+            tmpname = '%s.%d' % (libname[:-3], os.getpid())
+            f = open(tmpname + '.c', 'w')
+            f.write(code)
+            f.close()
+            try:
+                failure = subprocess.call(
+                    C_COMPILER.split() + ['-o', tmpname + '.so',
+                                          tmpname + '.c', '-lm'],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            finally:
+                os.remove(tmpname + '.c')
+            if failure:
+                return None
+            os.replace(tmpname + '.so', libname)
+        except OSError:
+            return None  # no compiler or no cache directory
+    try:
+        c_function = ctypes.CDLL(libname).sf_eval
+    except OSError:
+        return None
+    c_function.restype = None
+    c_function.argtypes = [ctypes.c_long] + \
+                          [ctypes.c_void_p]*(2 + len(variables))
+    return c_function
+
+
+def _c_evaluator(c_function, function, cells, prm_names, boolean=False):
+    """
+    Return a function evaluating c_function (from _c_library) for
+    array arguments. The parameter values are taken from cells (the
+    closure of the Python function). Scalar arguments, and parameters
+    that are not numbers, are evaluated by function (Python code).
+    If boolean is true (a comparison), the result is a boolean
+    array, as from NumPy.
+    """
+    def evaluate(*args):
+        if not [a for a in args if isinstance(a, (_np.ndarray, list, tuple))]:
+            return function(*args)
+        prm = [cells[k].cell_contents if k in cells else 0.0
+               for k in prm_names]
+        arrays = [_np.asarray(a) for a in args]
+        if [p for p in prm if not isinstance(p, (int, float, _np.integer,
+                                                 _np.floating))] or \
+           [a for a in arrays if a.dtype.kind not in 'biuf']:
+            return function(*args)  # array or complex parameters/arguments
+        prm = _np.array(prm, dtype=float)
+        arrays = _np.broadcast_arrays(*[a.astype(float, copy=False)
+                                        for a in arrays])
+        arrays = [_np.ascontiguousarray(a) for a in arrays]
+        r = _np.empty(arrays[0].shape if arrays else ())
+        c_function(r.size, r.ctypes.data, prm.ctypes.data,
+                   *[a.ctypes.data for a in arrays])
+        return r.astype(bool) if boolean else r
+    return evaluate
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _numba_ufunc(expression, variables, prm_names):
+    """
+    Return a NumPy ufunc (float64 values) of the independent
+    variables and the parameters (in that order), compiled by numba
+    from a module in C_CACHE_DIR (named by the hash of the code),
+    with numba's on-disk caching. Return None if numba is not
+    available or cannot compile the formula.
+    """
+    try:
+        import numba
+        from numba.core.errors import NumbaError
+    except ImportError:
+        return None
+    code = """\
+# generated by scitools.StringFunction
+from math import *
+
+def sf_func(%s):
+    return %s
+""" % (', '.join(tuple(variables) + tuple(prm_names)), expression)
+    key = hashlib.sha1(code.encode()).hexdigest()
+    modname = 'sf_%s' % key
+    filename = os.path.join(C_CACHE_DIR, modname + '.py')
+    try:
+        if not os.path.isfile(filename):
+            if not os.path.isdir(C_CACHE_DIR):
+                os.makedirs(C_CACHE_DIR)
+            tmpname = '%s.%d' % (filename, os.getpid())
+            f = open(tmpname, 'w')
+            f.write(code)
+            f.close()
+            os.replace(tmpname, filename)
+        spec = importlib.util.spec_from_file_location(modname, filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except (OSError, SyntaxError):
+        return None
+    signature = 'float64(%s)' % ', '.join(
+        ['float64']*(len(variables) + len(prm_names)))
+    # numba's cache imports the module by name when it loads the
+    # compiled code, so the module is registered while compiling:
+    sys.modules[modname] = module
+    try:
+        return numba.vectorize([signature], cache=True)(module.sf_func)
+    except NumbaError:
+        return None
+    finally:
+        del sys.modules[modname]
+
+
+def _numba_evaluator(expression, variables, function, cells, prm_names):
+    """
+    Return a function evaluating expression by the ufunc from
+    _numba_ufunc for array arguments, with the parameter values as
+    the last arguments (taken from cells, the closure of the Python
+    function). The ufunc is compiled at the first call with array
+    arguments. Scalar arguments, and formulas that numba cannot
+    compile, are evaluated by the Python function (calling a
+    numba-compiled scalar function from Python is slower than
+    calling the Python function, except for very costly formulas).
+    """
+    ufunc = []  # [ufunc or None] after the first call with arrays
+    # (parameters that are not in the formula get the value 0)
+    prm_cells = [cells[k] if k in cells else _cell(0.0)
+                 for k in prm_names]
+
+    def evaluate(*args):
+        all_args = args + tuple([c.cell_contents for c in prm_cells])
+        for a in all_args:
+            if isinstance(a, (_np.ndarray, list, tuple)):
+                if not ufunc:
+                    ufunc.append(_numba_ufunc(expression, variables,
+                                              prm_names))
+                if ufunc[0] is not None:
+                    try:
+                        return ufunc[0](*all_args)
+                    except TypeError:
+                        pass  # e.g. complex arrays for the float64 ufunc
+                break
+        return function(*args)
+    return evaluate
+
+
+def _cell(value):
+    """Return a closure cell with value."""
+    return (lambda: value).__closure__[0]
+
+
+def cache_info():
+    """
+    Return the hits, misses, max size and current size of the cache
+    of compiled StringFunction formulas (a functools.lru_cache).
+    """
+    return _lambda_code.cache_info()
+
+
+def cache_clear():
+    """Empty the cache of compiled StringFunction formulas."""
+    _lambda_code.cache_clear()
+    _vectorized_code.cache_clear()
+    _c_library.cache_clear()
+    _numba_ufunc.cache_clear()
 
 
 class StringFunction:
@@ -156,9 +683,67 @@ class StringFunction:
     f.vectorize(globals())
     to allow array arguments.
 
-    2) StringFunction builds a lambda function and evaluates this.
+    2) With the compile='c' argument to the constructor, the formula
+    is translated to C and compiled to a shared library (stored in
+    C_CACHE_DIR, compiled with C_COMPILER), which evaluates the
+    formula in a loop over NumPy array arguments (the result is an
+    array of floats, or booleans for a comparison)::
+
+       f = StringFunction('exp(-a*x)*sin(w*x)', a=0.5, w=2, compile='c')
+       y = f(linspace(0, 10, 1000001))   # C code
+       y = f(0.5)                        # Python code
+
+    Scalar arguments, parameters that are not numbers, and formulas
+    that cannot be translated to C (or when no C compiler is found)
+    are evaluated in Python, with NumPy functions unless the
+    globals keyword argument is given.
+    The results are the same with and without a C compiler:
+
+    >>> from numpy import linspace, exp, sin, allclose
+    >>> x = linspace(0, 1, 11)
+    >>> f = StringFunction('exp(-a*x)*sin(w*x) + n', a=0.5, w=2, n=1,
+    ...                    compile='c')
+    >>> allclose(f(x), exp(-0.5*x)*sin(2*x) + 1)
+    True
+    >>> f.set_parameters(w=3)
+    >>> allclose(f(x, n=2), exp(-0.5*x)*sin(3*x) + 2)
+    True
+    >>> allclose(f(x), exp(-0.5*x)*sin(3*x) + 1)
+    True
+
+    Small integer powers are computed by multiplications (not pow),
+    and comparisons give boolean arrays, as in NumPy:
+
+    >>> p = StringFunction('3*x**3 - 2*x**2 + x - 1 + x**-1', compile='c')
+    >>> allclose(p(x[1:]), 3*x[1:]**3 - 2*x[1:]**2 + x[1:] - 1 + 1/x[1:])
+    True
+    >>> StringFunction('x > 0.5', compile='c')(x[4:8])
+    array([False, False,  True,  True])
+
+    With compile='numba' (the default if OPTIMIZATION is 'numba' in
+    the scitools configuration file), the formula is compiled by
+    numba, if available, as a NumPy ufunc for array arguments
+    (float64 values) at the first call with array arguments, with
+    the compiled code cached in C_CACHE_DIR. Formulas that numba
+    cannot compile (or when numba is not installed), and scalar
+    arguments, are evaluated in Python as for compile='c'.
+    The results are the same with and without numba:
+
+    >>> from numpy import linspace, exp, sin, allclose
+    >>> x = linspace(0, 1, 11)
+    >>> f = StringFunction('exp(-a*x)*sin(w*x)', a=0.5, w=2,
+    ...                    compile='numba')
+    >>> allclose(f(x), exp(-0.5*x)*sin(2*x))
+    True
+    >>> allclose(f(x, w=3), exp(-0.5*x)*sin(3*x))
+    True
+    >>> allclose(f(0.5), exp(-0.25)*sin(1.0))
+    True
+
+    3) StringFunction builds a lambda function and evaluates this.
     You can see the lambda function as a string by accessing the
-    _lambda attribute.
+    _lambda attribute (the translated function after
+    f.vectorize(optimize=True)).
     """
 
     def __init__(self, expression, **kwargs):
@@ -219,6 +804,19 @@ class StringFunction:
             del self._prms['globals']
         except:
             pass
+        # compile='c': array arguments are evaluated in compiled C code,
+        # compile='numba': numba-compiled functions (default if
+        # OPTIMIZATION is 'numba' in the scitools configuration file)
+        self._compile = self._prms.pop(
+            'compile', 'numba' if OPTIMIZATION == 'numba' else None)
+        if self._compile is not None:
+            self._compile = str(self._compile).lower()
+            if self._compile not in ('c', 'numba'):
+                raise ValueError('compile=%r is not supported (only "c" '
+                                 'or "numba")' % self._compile)
+            if 'globals' not in kwargs:
+                # NumPy functions for array arguments if compiling fails
+                self._globals = _np.__dict__
         try:
             # may fail if not all parameters are defined yet
             self._build_lambda()
@@ -229,71 +827,130 @@ class StringFunction:
     def _build_lambda(self):
         """
         Translate the expression to a lambda function taking the
-        independent variables as positional arguments and the
-        parameters as keyword arguments.
+        independent variables as positional arguments, with the
+        parameters as variables in the closure of the function.
         The idea is due to Mario Pernici <Mario.Pernici@mi.infn.it>.
+        The compiled code is cached (see _lambda_code), such that
+        only the parameter values are bound here.
         """
-        args = ', '.join(self._var)
-        s = 'lambda ' + args
-
-        # add parameters as keyword arguments:
-        if self._prms:
-            kwargs = ', '.join(['%s=%s' % (k, self._prms[k])
-                                for k in self._prms])
-            s += ', ' + kwargs
-        else:
-            kwargs = ''
-
-        if self._function_in_module is None:
-            # insert string expression as body in the lambda function:
-            s += ': ' + self._f
+        prm_names = tuple(self._prms)
+        optimized = None
+        if getattr(self, '_optimize', False) and \
+           self._function_in_module is None:
+            optimized = _vectorized_code(self._f, self._var, prm_names)
+        if optimized is not None:
+            code, self._lambda = optimized
+            namespace = {'_np': _np, '_ufunc': _ufunc}
+            exec(code, namespace)
+            self.__call__ = namespace['_factory'](
+                *[self._prms[k] for k in prm_names])
         else:
-            exec('import ' + self._function_in_module[0])
-            # let lambda call a function in a file (module):
-            s += ', module=%s: module.%s(%s, %s)' % \
-                 (self._function_in_module[0],
-                  self._function_in_module[1],
-                  args, kwargs)
-            # note: we could use self._f directly here (giving the
-            # full module path), but then we need to do import first,
-            # all this is done in the __init__ and then it is simpler
-            # to just let self_function_in_module point to the imported
-            # function
-
-        self._lambda = s  # store lambda function code; just for convenience
-
-        try:
-            if self._function_in_module is None:
-                try:
-                    self.__call__ = eval(s, self._globals)
-                except Exception as e:
-                    print("""
+            try:
+                code, s = _lambda_code(self._f, self._var, prm_names,
+                                       self._function_in_module)
+            except Exception as e:
+                print("""
 Making StringFunction with formula %s failed!
-Tried to build a lambda function:\n %s""" % (self._f, s))
-                    raise e
+Tried to build a lambda function of %s with parameters %s""" %
+                      (self._f, ', '.join(self._var), ', '.join(prm_names)))
+                raise e
+            self._lambda = s  # store lambda function code; just for convenience
 
-                # the following makes all instances have the same function :-(
-                ##StringFunction.__call__ = eval(s, self._globals)
+            values = [self._prms[k] for k in prm_names]
+            if self._function_in_module is None:
+                factory = eval(code, self._globals)
             else:
-                # didn't work with self._globals...and we don't need it...????
-                self.__call__ = eval(s, globals(), locals())
-                #self.__call__ = eval(s)
-                # print 'call is', self.__call__
+                values.append(importlib.import_module(
+                    self._function_in_module[0]))
+                factory = eval(code, {})
+            self.__call__ = factory(*values)
+        # the cells with the parameter values (only the parameters
+        # that appear in the expression):
+        self._cells = dict(zip(self.__call__.__code__.co_freevars,
+                               self.__call__.__closure__ or ()))
+
+        if getattr(self, '_compile', None) == 'c' and \
+           self._function_in_module is None:
+            c_function = _c_library(self._f, self._var, prm_names)
+            if c_function is not None:
+                self.__call__ = _c_evaluator(c_function, self.__call__,
+                                             self._cells, prm_names,
+                                             _is_comparison(self._f))
+        elif getattr(self, '_compile', None) == 'numba' and \
+             self._function_in_module is None:
+            self.__call__ = _numba_evaluator(self._f, self._var,
+                                             self.__call__, self._cells,
+                                             prm_names)
+
+    def __call__(self, *args, **kwargs):
+        """
+        Evaluate the function. Parameters can be given as keyword
+        arguments; they are then used in this call only.
+        (Such calls are not thread safe, since the parameter values
+        are temporarily changed in the function.)
+        """
+        # (self.__call__ is set by _build_lambda, but Python 3 looks up
+        # __call__ in the class when calling the instance)
+        if not kwargs:
+            return self.__dict__['__call__'](*args)
+        saved = {}
+        try:
+            for name in kwargs:
+                if name not in self._prms:
+                    raise TypeError('%s is not a parameter in %s' %
+                                    (name, repr(self)))
+                if name in self._cells:
+                    saved[name] = self._cells[name].cell_contents
+                    self._cells[name].cell_contents = kwargs[name]
+            return self.__dict__['__call__'](*args)
+        finally:
+            for name in saved:
+                self._cells[name].cell_contents = saved[name]
+
+    def __copy__(self):
+        """
+        Return a copy with its own function (the parameter values
+        are held in the closure of the function, which must not be
+        shared with the copy).
+        """
+        return self._copy(self._prms.copy())
 
-        except NameError as e:
-            prm = str(e).split()[1]
-            raise NameError('name "%s" is not defined - if it is '
-                            'a parameter,\nset it in the constructor or the '
-                            'set_parameters method, or provide\nglobals=globals() '
-                            'in the constructor if "%s" is a global name in the '
-                            'calling code.' % (prm, prm))
+    def __deepcopy__(self, memo):
+        return self._copy(copy.deepcopy(self._prms, memo))
+
+    def _copy(self, prms):
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other._prms = prms
+        if '_cells' in self.__dict__:
+            other._build_lambda()
+        return other
 
     def set_parameters(self, **kwargs):
-        """Set keyword parameters in the function."""
+        """
+        Set keyword parameters in the function.
+        Changing the values of existing parameters just updates the
+        values in the function (any Python object can be a value);
+        new parameter names require a new function. Copies (made by
+        the copy module) have their own parameter values:
+
+        >>> import copy
+        >>> f = StringFunction('a*x**2', a=1)
+        >>> g = copy.copy(f)
+        >>> g.set_parameters(a=10)
+        >>> f(2), g(2), copy.deepcopy(g)(2)
+        (4, 40, 40)
+        """
+        new_names = [name for name in kwargs if name not in self._prms]
         self._prms.update(kwargs)
-        self._build_lambda()
+        if new_names or not hasattr(self, '_cells'):
+            self._build_lambda()
+        else:
+            for name in kwargs:
+                if name in self._cells:
+                    self._cells[name].cell_contents = kwargs[name]
 
-    def vectorize(self, globals_dict):
+    def vectorize(self, globals_dict=None, optimize=False):
         """
         Allow the StringFunction object to take NumPy array
         arguments. The calling code must have done a
@@ -301,8 +958,21 @@ Tried to build a lambda function:\n %s""" % (self._f, s))
         dictionary as the argument globals_dict.
         Alternatively, the globals() dictionary can be supplied
         as a globals keyword argument to the constructor.
+
+        With optimize=True, the formula is translated to a sequence
+        of NumPy ufunc calls, where common subexpressions (like
+        exp(-a*x) in exp(-a*x)*sin(w*x) + exp(-a*x)) are computed
+        once and temporary arrays are reused for the results of
+        later calls. The translated code is available in the
+        _lambda attribute. Formulas with other constructions
+        than numbers, operators, comparisons and standard math
+        functions are evaluated as usual, with the functions in
+        globals_dict (default: numpy).
         """
+        if globals_dict is None:
+            globals_dict = _np.__dict__
         self._globals = globals_dict
+        self._optimize = optimize
         self._build_lambda()
 
     def troubleshoot(self, *args, **kwargs):
@@ -370,8 +1040,11 @@ Tried to build a lambda function:\n %s""" % (self._f, s))
 
     def __repr__(self):
         """Return the code required to reconstruct this instance."""
-        kwargs = ', '.join(['%s=%s' % (key, repr(value))
-                            for key, value in list(self._prms.items())])
+        kwargs = ['%s=%s' % (key, repr(value))
+                  for key, value in list(self._prms.items())]
+        if self._compile is not None:
+            kwargs.append('compile=%s' % repr(self._compile))
+        kwargs = ', '.join(kwargs)
         return """StringFunction(%s, independent_variables=%s, %s)""" % \
                (repr(self._f), repr(self._var), kwargs)
 
@@ -29,6 +29,7 @@ text in the book "Python Scripting for Computational Science", by
 H. P. Langtangen, 3rd edition, 2nd printing, Springer, 2009:
 
   - NumPyDB: a simple database for holding NumPy arrays
+  - NumPyDB_benchmark: timing of the storage backends in NumPyDB
   - Regression: module for performing regression tests (also with floats)
   - CanvasCoord: transformations between canvas and physical coordinates
   - DrawFunction: enables users to draw a function (in Pmw.Blt plotting widget)
@@ -40,6 +41,8 @@ H. P. Langtangen, 3rd edition, 2nd printing, Springer, 2009:
 Some preliminary modules include
   - BoxGrid: a structured grid in 1D, 2D, or 2D
   - BoxField: a scalar or vector field over a BoxGrid
+  - BlockBoxField: a BoxField divided into blocks in shared memory
+  - BoxFieldSeries: time series of BoxFields stored on disk
 
 See the different modules for more detailed information.
 
@@ -951,6 +951,11 @@ def wrap2callable(f, **kwargs):
 
     to wrap2callable. See also the documentation of class StringFunction
     for more information.
+
+    With OPTIMIZATION = numba in the scitools configuration file (and
+    numba installed), string formulas are compiled by numba, such that
+    calls with array arguments run compiled code (the compile keyword
+    argument to StringFunction overrides this).
     """
     if isinstance(f, str):
         return StringFunction(f, **kwargs)